@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+"""Benchmark gap-filling of minute buckets on synthetic sparse trades."""
+import random
+import sys
+from datetime import datetime, timedelta
+from os.path import abspath, dirname
+from time import perf_counter
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from modules.helpers import to_date, to_string  # noqa: E402
+from modules.series import filled, labels, minutes  # noqa: E402
+
+
+def synthetic(minutes, density=0.3, seed=42):
+    """Build chronological aggregation rows with random minute gaps."""
+    rng = random.Random(seed)
+    start = datetime(2018, 1, 1)
+    price = 0.001
+    rows = []
+    for m in range(minutes):
+        if m and rng.random() > density:
+            continue
+        price *= 1 + rng.gauss(0, 0.002)
+        quantity = rng.uniform(1, 100)
+        stamp = to_string(start + timedelta(minutes=m))
+        rows.append({'_id': {'datehours': stamp.split(':')[0],
+                             'minutes': stamp.split(':')[1]},
+                     'datetime': stamp,
+                     'sum_quantity': quantity,
+                     'sum_total': quantity * price,
+                     'price': price})
+    return rows
+
+
+def legacy(rows):
+    """Gap-filling loop as it was implemented in points()."""
+    generator = rows[::-1]
+    b = []
+    for i in generator[::-1]:
+        i['datetime'] = i['_id']['datehours'] + \
+            ':' + i['_id']['minutes']
+        if generator[::-1].index(i) == 0:
+            b.append(i.copy())
+            continue
+        position = b.index(b[-1])
+        difference = to_date(i['datetime']) -\
+            to_date(b[position]['datetime'])
+        if int(difference.total_seconds()) / 60 > 1:
+            price = b[position]['price']
+            base = to_date(i['datetime'])
+            date_list = [
+                base - timedelta(minutes=x + 1)
+                for x in range(0, int(difference.total_seconds() / 60
+                                      ) - 1)
+            ][::-1]
+            for d in date_list:
+                b.append({'datetime': to_string(d),
+                          'price': price,
+                          'sum_quantity': 0})
+        b.append(i.copy())
+    return b
+
+
+def columnar(rows):
+    """Gap-fill rows the way buckets() does and return them as rows."""
+    minute, price, volume = filled(
+        minutes([r['datetime'] for r in rows]),
+        np.array([r['price'] for r in rows]),
+        np.array([r['sum_quantity'] for r in rows]), 1)
+    return [{'datetime': d, 'price': p, 'sum_quantity': q}
+            for d, p, q in zip(labels(minute), price.tolist(),
+                               volume.tolist())]
+
+
+def timed(func, rows):
+    """Return result and elapsed seconds of func over a copy of rows."""
+    rows = [dict(r) for r in rows]
+    started = perf_counter()
+    result = list(func(rows))
+    return result, perf_counter() - started
+
+
+def fields(rows):
+    """Return the gap-filled columns compared between implementations."""
+    return [(r['datetime'], r['price'], r['sum_quantity']) for r in rows]
+
+
+if __name__ == '__main__':
+    for span in (1000, 5000, 20000, 43200):
+        rows = synthetic(span)
+        new, new_time = timed(columnar, rows)
+        if span <= 20000:
+            old, old_time = timed(legacy, rows)
+            assert fields(old) == fields(new), 'Outputs differ!'
+            old_time = '{:.3f}s'.format(old_time)
+        else:
+            old_time = 'skipped'
+        print('{:>6} minutes, {:>6} rows: legacy {:>9}, filled {:.3f}s'
+              .format(span, len(rows), old_time, new_time))
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+"""Decimal reference of the indicators for the golden-output checks.
+
+These follow the original Decimal loops of summarize() and
+three_graphs(), one bucket at a time, so the vectorized float64 engine
+can be checked against them on any synthetic series.
+"""
+from decimal import Decimal
+
+
+def mean(values):
+    """Return the Decimal average of prices."""
+    values = [Decimal(v) for v in values]
+    return sum(values) / len(values)
+
+
+def macd(prices, fast, slow, signal, seed_fast=0, seed_slow=0):
+    """Return the MACD columns of chronological prices as Decimal lists."""
+    alphas = [Decimal(2.0 / (1.0 + float(p))) for p in (fast, slow, signal)]
+    ema_fast, ema_slow, signal_line = Decimal(seed_fast), \
+        Decimal(seed_slow), Decimal(0)
+    columns = {k: [] for k in ('price', 'ema_fast', 'ema_slow', 'macd',
+                               'signal_line', 'macd_hist')}
+    for price in prices:
+        price = Decimal(price)
+        ema_fast = alphas[0] * price + (1 - alphas[0]) * ema_fast
+        ema_slow = alphas[1] * price + (1 - alphas[1]) * ema_slow
+        line = ema_fast - ema_slow
+        signal_line = alphas[2] * line + (1 - alphas[2]) * signal_line
+        for k, v in zip(columns, (price, ema_fast, ema_slow, line,
+                                  signal_line, line - signal_line)):
+            columns[k].append(v)
+    return columns
+
+
+def signals(prices, fast, slow, signal, fromdate=False):
+    """Return summarize() columns, seeding the latest window like it does."""
+    prices = list(prices)
+    if fromdate:
+        return macd(prices, fast, slow, signal)
+    if len(prices) < 42:
+        return macd([], fast, slow, signal)
+    return macd(prices[-40:], fast, slow, signal, mean(prices[-53:-41]),
+                mean(prices[:-41]))
+
+
+def momentum(prices, volumes, period=14, window=25):
+    """Return the RSI, OBV and Aroon columns as Decimal lists."""
+    alpha = Decimal(1) / Decimal(period)
+    smmau = smmad = Decimal(1)
+    obv = Decimal(0)
+    previous = None
+    history = []
+    columns = {k: [] for k in ('rsi', 'obv', 'aroonup', 'aroondown')}
+    for price, volume in zip(prices, volumes):
+        price, volume = Decimal(price), Decimal(volume)
+        if previous is None:
+            up, down, updown = price, Decimal(0), 1
+        else:
+            up = max(price - previous, Decimal(0))
+            down = max(previous - price, Decimal(0))
+            updown = 1 if price > previous else -1
+        smmau = alpha * up + (1 - alpha) * smmau
+        smmad = alpha * down + (1 - alpha) * smmad
+        obv += updown * volume / price
+        recent = history[::-1] or [price]
+        columns['rsi'].append(Decimal(100) - Decimal(100) /
+                              (1 + smmau / smmad) if smmad else
+                              Decimal(100))
+        columns['obv'].append(obv)
+        columns['aroonup'].append(
+            (window - (recent.index(max(recent)) + 1)) / Decimal(window) *
+            100)
+        columns['aroondown'].append(
+            (window - (recent.index(min(recent)) + 1)) / Decimal(window) *
+            100)
+        history = (history + [price])[-(window - 1):]
+        previous = price
+    return columns
@@ -0,0 +1,26 @@
+#!/usr/bin/python3
+"""Throwaway benchmark database shared by the benchmark scripts."""
+import sys
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import modules.database  # noqa: E402
+
+
+def database(uri):
+    """Return an empty benchmark database on mongod or in mongomock."""
+    if uri:
+        from pymongo import MongoClient
+        client = MongoClient(uri)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    client.drop_database('benchmark')
+    return client.benchmark
+
+
+def bind(db):
+    """Resolve the collections of every module on a benchmark database."""
+    modules.database.NAME = db.name
+    modules.database.shared = db.client
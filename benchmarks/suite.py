@@ -0,0 +1,218 @@
+#!/usr/bin/python3
+"""Benchmark the helpers hot paths on synthetic trades.
+
+Usage: suite.py [--uri mongodb://localhost:27017] [--sizes 1000 ...]
+                [--intervals 1 5 ...] [--output results.json]
+                [--baseline previous.json] [--threshold 0.25]
+
+Each size is loaded into a fresh database, rolled up into bars and used
+to time points(), summarize(), three_graphs(), datacenter_report() and
+fetch() for every interval. Results are written as JSON; given a
+baseline, timings slower by more than `threshold` are flagged and the
+exit status is 1. Unless --no-golden is given, the indicator outputs are
+also checked against the Decimal reference.
+
+Without --uri the data lives in mongomock, whose aggregation keeps sizes
+up to about 1e5 practical; against a throwaway mongod the default sizes
+go from 1e3 to 1e7 trades.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from os.path import abspath, dirname
+from time import perf_counter
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+import reference  # noqa: E402
+from sandbox import bind, database  # noqa: E402
+import synthetic  # noqa: E402
+from modules import bittrex, helpers, rollups  # noqa: E402
+
+# Parameters of the timed calls
+FAST, SLOW, SIGNAL = 12, 26, 9
+# Timings shorter than this many seconds are never flagged
+NOISE = 0.002
+# Largest error allowed against the Decimal reference, relative to the
+# magnitude of each column
+TOLERANCE = 1e-9
+
+
+def form(date):
+    """Format a datetime the way the web forms send it."""
+    return date.strftime('%m/%d/%Y %I:%M %p')
+
+
+def timed(func, repeat, *args):
+    """Return the best elapsed seconds of `repeat` calls and the result."""
+    best = None
+    for n in range(repeat):
+        started = perf_counter()
+        result = func(*args)
+        elapsed = perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def record(entries, function, size, interval, seconds, result):
+    """Append a timing entry and print it."""
+    if isinstance(result, str):
+        rows = None
+    else:
+        rows = len(result) if result else 0
+    entries.append({'function': function, 'size': size,
+                    'interval': interval, 'seconds': seconds, 'rows': rows})
+    print('{:>20} {:>9} trades {:>4}: {:9.4f}s {:>8} rows'.format(
+        function, size, '{}m'.format(interval) if interval else '',
+        seconds, '-' if rows is None else rows))
+
+
+def calls(interval, todate, fromdate, coin):
+    """Return the (name, function, arguments) timed for an interval."""
+    return [
+        ('points', helpers.points, (interval, todate, coin)),
+        ('points range', helpers.points, (interval, todate, coin, fromdate)),
+        ('summarize', helpers.summarize,
+         (interval, todate, coin, FAST, SLOW, SIGNAL)),
+        ('summarize range', helpers.summarize,
+         (interval, todate, coin, FAST, SLOW, SIGNAL, fromdate)),
+        ('three_graphs', helpers.three_graphs,
+         (interval, todate, coin, '')),
+        ('three_graphs range', helpers.three_graphs,
+         (interval, todate, coin, fromdate)),
+        ('datacenter_report', helpers.datacenter_report,
+         (interval, todate, '', FAST, SLOW, SIGNAL, fromdate)),
+    ]
+
+
+def error(series, columns):
+    """Return the largest relative error of a series against Decimals."""
+    worst = 0.0
+    for name, values in columns.items():
+        expected = np.array([float(v) for v in values])
+        actual = series[name] if series else np.array([])
+        if len(actual) != len(expected) or not np.array_equal(
+                np.isnan(actual), np.isnan(expected)):
+            return float('inf')
+        if not len(expected) or np.isnan(expected).all():
+            continue
+        scale = max(1.0, np.nanmax(np.abs(expected)))
+        worst = max(worst, np.nanmax(np.abs(actual - expected)) / scale)
+    return worst
+
+
+def golden(interval, todate, fromdate, coin):
+    """Return (name, error) of each indicator output against Decimals."""
+    latest = helpers.points(interval, todate, coin)
+    ranged = helpers.points(interval, todate, coin, fromdate)
+    return [
+        ('summarize', error(
+            helpers.summarize(interval, todate, coin, FAST, SLOW, SIGNAL),
+            reference.signals(latest['price'][-67:], FAST, SLOW, SIGNAL))),
+        ('summarize range', error(
+            helpers.summarize(interval, todate, coin, FAST, SLOW, SIGNAL,
+                              fromdate),
+            reference.signals(ranged['price'], FAST, SLOW, SIGNAL, True))),
+        ('three_graphs', error(
+            helpers.three_graphs(interval, todate, coin, ''),
+            reference.momentum(latest['price'], latest['volume']))),
+        ('three_graphs range', error(
+            helpers.three_graphs(interval, todate, coin, fromdate),
+            reference.momentum(ranged['price'], ranged['volume']))),
+    ]
+
+
+def run(uri, sizes, intervals, repeat, check):
+    """Benchmark every size and interval and return the result entries."""
+    entries = []
+    failures = []
+    for size in sizes:
+        db = database(uri)
+        bind(db)
+        seconds, last = timed(synthetic.load, 1, db.market, size)
+        record(entries, 'load', size, None, seconds, range(size))
+        seconds, result = timed(rollups.backfill, 1)
+        record(entries, 'backfill', size, None, seconds,
+               range(db.bars_1m.count_documents({})))
+        fromdate = form(synthetic.START)
+        todate = form(last + timedelta(minutes=1))
+        coin = synthetic.markets()[1][0][4:]
+        seconds, result = timed(bittrex.fetch, repeat, fromdate, todate,
+                                coin)
+        record(entries, 'fetch', size, None, seconds,
+               range(result[1] if result else 0))
+        for interval in intervals:
+            for name, func, args in calls(interval, todate, fromdate, coin):
+                seconds, result = timed(func, repeat, *args)
+                record(entries, name, size, interval, seconds, result)
+            if not check:
+                continue
+            for name, worst in golden(interval, todate, fromdate, coin):
+                if worst > TOLERANCE:
+                    failures.append('{} {} trades {}m: error {:.3g}'.format(
+                        name, size, interval, worst))
+    return entries, failures
+
+
+def regressions(entries, baseline, threshold):
+    """Return the entries slower than their baseline by over `threshold`."""
+    before = {(e['function'], e['size'], e['interval']): e['seconds']
+              for e in baseline['results']}
+    slower = []
+    for entry in entries:
+        previous = before.get((entry['function'], entry['size'],
+                               entry['interval']))
+        if previous is None or entry['seconds'] < NOISE:
+            continue
+        if entry['seconds'] > previous * (1 + threshold):
+            slower.append(dict(entry, baseline=previous))
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Helpers benchmark suite.')
+    parser.add_argument('--uri', help='mongod URI, mongomock by default')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='trade counts, up to 1e4 on mongomock and '
+                             '1e7 on mongod by default')
+    parser.add_argument('--intervals', type=int, nargs='+',
+                        default=[1, 5, 15, 60])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--baseline', help='results JSON to compare with')
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--no-golden', action='store_true',
+                        help='skip the Decimal reference checks')
+    options = parser.parse_args()
+    sizes = options.sizes or ([10 ** n for n in range(3, 8)] if options.uri
+                              else [1000, 10000])
+    output = abspath(options.output)
+    baseline = options.baseline and json.load(open(options.baseline))
+    # fetch() and datacenter_report() write to archive/
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs('archive')
+    entries, failures = run(options.uri, sizes, options.intervals,
+                            options.repeat, not options.no_golden)
+    with open(output, 'w') as dump:
+        json.dump({'created': datetime.utcnow().isoformat(),
+                   'backend': 'mongod' if options.uri else 'mongomock',
+                   'python': platform.python_version(),
+                   'numpy': np.__version__,
+                   'machine': platform.platform(),
+                   'results': entries}, dump, indent=1)
+    print('Results written to {}.'.format(output))
+    for failure in failures:
+        print('GOLDEN MISMATCH {}'.format(failure))
+    slower = regressions(entries, baseline, options.threshold) \
+        if baseline else []
+    for entry in slower:
+        print('REGRESSION {function} {size} trades {interval}m: '
+              '{seconds:.4f}s, was {baseline:.4f}s'.format(**entry))
+    if failures or slower:
+        raise SystemExit(1)
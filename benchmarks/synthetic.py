@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+"""Deterministic synthetic market trades for the benchmark suite.
+
+Dense pairs trade nearly every minute, several times a minute; sparse
+pairs trade now and then and go quiet for hours. Both random-walk their
+price and pause for random gaps, so bucket gap-filling is exercised the
+way real Bittrex histories do. The same seed always yields the same
+trades, Ids and timestamps.
+"""
+import random
+from datetime import datetime, timedelta
+
+from modules.bittrex import coins_list
+
+# Trading behaviour per profile: chance a minute has trades, most trades
+# in such a minute, chance a quiet gap starts and its mean length
+PROFILES = {'dense': {'active': 0.97, 'trades': 8, 'quiet': 0.001,
+                      'gap': 20},
+            'sparse': {'active': 0.15, 'trades': 2, 'quiet': 0.01,
+                       'gap': 240}}
+
+START = datetime(2018, 1, 1)
+
+
+def markets(pairs=8):
+    """Return (pair, profile) for the synthetic pairs, half of them dense."""
+    return [('BTC-' + coin, 'dense' if i % 2 else 'sparse')
+            for i, coin in enumerate(coins_list[:pairs])]
+
+
+def trades(count, pairs=8, seed=42, start=START):
+    """Yield `count` typed trades in Id and time order, minute by minute."""
+    rng = random.Random(seed)
+    state = {pair: {'price': rng.uniform(0.0001, 0.01), 'quiet': 0}
+             for pair, profile in markets(pairs)}
+    made = 0
+    minute = 0
+    while made < count:
+        fills = []
+        for pair, profile in markets(pairs):
+            data, kind = state[pair], PROFILES[profile]
+            if minute < data['quiet']:
+                continue
+            if rng.random() < kind['quiet']:
+                data['quiet'] = minute + int(rng.expovariate(
+                    1 / kind['gap'])) + 1
+                continue
+            if rng.random() >= kind['active']:
+                continue
+            for n in range(rng.randint(1, kind['trades'])):
+                data['price'] *= 1 + rng.gauss(0, 0.002)
+                fills.append((rng.randrange(60000), pair, data['price']))
+        for offset, pair, price in sorted(fills):
+            if made == count:
+                return
+            made += 1
+            quantity = rng.uniform(1, 500)
+            yield {'Id': made,
+                   'Pair': pair,
+                   'TimeStamp': start + timedelta(minutes=minute,
+                                                  milliseconds=offset),
+                   'Quantity': quantity,
+                   'Price': price,
+                   'Total': quantity * price,
+                   'FillType': 'FILL' if rng.random() < 0.8
+                   else 'PARTIAL_FILL',
+                   'OrderType': 'BUY' if rng.random() < 0.5 else 'SELL'}
+        minute += 1
+
+
+def load(collection, count, pairs=8, seed=42, batch=10000):
+    """Insert synthetic trades and return the last TimeStamp stored."""
+    rows = []
+    last = START
+    for trade in trades(count, pairs, seed):
+        rows.append(trade)
+        if len(rows) == batch:
+            collection.insert_many(rows, ordered=False)
+            last = rows[-1]['TimeStamp']
+            rows = []
+    if rows:
+        collection.insert_many(rows, ordered=False)
+        last = rows[-1]['TimeStamp']
+    return last
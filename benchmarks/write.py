@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+"""Benchmark the trade write step against mongomock or a local mongod.
+
+Usage: write.py [mongodb://localhost:27017]
+
+Both paths store the same typed trades; bar rollups and pair statistics
+are left out so only the writes are compared.
+
+mongomock has no network round-trips, so the gap it reports is only the
+client-side part of the speed-up; run against mongod for real numbers.
+"""
+import random
+import sys
+from datetime import datetime, timedelta
+from os.path import abspath, dirname
+from time import perf_counter
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from modules import bittrex, storage  # noqa: E402
+from sandbox import database  # noqa: E402
+
+
+def polls(markets=20, sweeps=3, size=100, overlap=0.7, seed=42):
+    """Build market-history responses with trades repeated across sweeps."""
+    rng = random.Random(seed)
+    start = datetime(2018, 1, 1)
+    ids = {}
+    for sweep in range(sweeps):
+        for m in range(markets):
+            pair = 'BTC-M{}'.format(m)
+            fresh = size if not sweep else int(size * (1 - overlap))
+            top = ids.get(pair, 0) + fresh
+            ids[pair] = top
+            trades = []
+            for i in range(top, top - size, -1):
+                price = rng.uniform(0.0001, 0.01)
+                quantity = rng.uniform(1, 100)
+                trades.append({
+                    'Id': i, 'Pair': pair,
+                    'TimeStamp': (start + timedelta(seconds=i)).isoformat(),
+                    'Quantity': quantity, 'Price': price,
+                    'Total': price * quantity,
+                    'FillType': 'FILL', 'OrderType': 'BUY'})
+            yield trades
+
+
+def legacy(collection, trades):
+    """Upsert trades one round-trip at a time, as write() used to."""
+    [collection.update_one(
+     filter={'Id': i['Id'], 'Pair': i['Pair']},
+     update={'$set': i},
+     upsert=True
+     ) for i in trades
+     ]
+
+
+def bulk(collection, trades):
+    """Upsert trades in one unordered bulk write through storage.write()."""
+    storage.write(collection, trades, 'documents')
+
+
+if __name__ == '__main__':
+    uri = sys.argv[1] if len(sys.argv) > 1 else None
+    for name, func in (('update_one', legacy), ('bulk_write', bulk)):
+        db = database(uri)
+        batches = [[bittrex.typed(t) for t in trades] for trades in polls()]
+        total = 0
+        started = perf_counter()
+        for trades in batches:
+            total += len(trades)
+            func(db.market, trades)
+        elapsed = perf_counter() - started
+        print('{:>10}: {} trades in {:.2f}s, {:.0f} trades/s, {} stored'
+              .format(name, total, elapsed, total / elapsed,
+                      db.market.count_documents({})))
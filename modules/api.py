@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+"""Columnar JSON chart series for the graph pages.
+
+Series are sent as one array per column with epoch-second timestamps,
+encoded with orjson when it is installed and gzipped when the client
+accepts it. Responses carry an ETag so unchanged series revalidate with
+a 304. Long ranges can be downsampled with Largest-Triangle-Three-Buckets
+after the indicators were computed at full resolution.
+"""
+import gzip
+import hashlib
+import json
+
+import numpy as np
+from flask import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Columns of each graph page besides the timestamps
+SERIES = {'graph': ['price', 'ema_fast', 'ema_slow', 'macd', 'signal_line',
+                    'macd_hist'],
+          'graphaddon': ['rsi', 'obv', 'aroonup', 'aroondown']}
+
+# Smallest body worth compressing
+GZIP_MIN = 1024
+
+
+def columnar(kind, series):
+    """Convert an indicator series into one list per column."""
+    if not series:
+        return dict({'t': []}, **{f: [] for f in SERIES[kind]})
+    data = {'t': (series['minute'] * 60).tolist()}
+    for field in SERIES[kind]:
+        data[field] = series[field].tolist()
+    return data
+
+
+def lttb(values, threshold):
+    """Return the indices Largest-Triangle-Three-Buckets keeps of a series.
+
+    The first and last points are always kept. Every other bucket keeps
+    the point forming the largest triangle with the point kept before it
+    and the average of the next bucket.
+    """
+    size = len(values)
+    if threshold < 3 or threshold >= size:
+        return np.arange(size)
+    y = np.asarray(values, dtype=np.float64)
+    x = np.arange(size, dtype=np.float64)
+    edges = np.arange(threshold - 1) * (size - 2) // (threshold - 2) + 1
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0], kept[-1] = 0, size - 1
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        following = slice(end, edges[i + 2]) if i + 3 < threshold \
+            else slice(size - 1, size)
+        mean_x, mean_y = x[following].mean(), y[following].mean()
+        areas = np.abs((x[previous] - mean_x) * (y[start:end] - y[previous]) -
+                       (x[previous] - x[start:end]) * (mean_y - y[previous]))
+        previous = start + int(np.argmax(areas))
+        kept[i + 1] = previous
+    return kept
+
+
+def downsample(data, max_points):
+    """Keep about `max_points` timestamps of columnar series.
+
+    Each series gets an equal share of the points and keeps the ones
+    LTTB selects for its own shape. The union stays aligned on the
+    shared timestamps.
+    """
+    series = [f for f in data if f != 't']
+    if not max_points or len(data['t']) <= max_points:
+        return data
+    share = max(3, max_points // len(series))
+    kept = np.unique(np.concatenate(
+        [lttb(data[f], share) for f in series])).tolist()
+    return {k: [v[i] for i in kept] for k, v in data.items()}
+
+
+def dumps(data):
+    """Encode data as compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode()
+
+
+def respond(request, data):
+    """Return a conditional, optionally gzipped JSON response."""
+    body = dumps(data)
+    etag = hashlib.sha1(body).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings and len(body) >= GZIP_MIN:
+        response = Response(gzip.compress(body, 6),
+                            mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag, weak=True)
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
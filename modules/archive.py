@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""Row and columnar writers for datacenter archive files.
+
+Parquet needs pyarrow; without it the columnar option falls back to
+compressed NumPy `.npz` archives.
+"""
+import csv
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Float columns of the indicator reports
+FLOATS = ['volume', 'price', 'ema_fast', 'ema_slow', 'macd',
+          'signal_line', 'macd_hist']
+
+
+def columns(series=None):
+    """Return the typed columns of an indicator series, newest first."""
+    if series is None:
+        return dict(pair=np.array([], dtype=str),
+                    interval=np.array([], dtype=np.int32),
+                    datetime=np.array([], dtype='datetime64[s]'),
+                    **{f: np.array([], dtype=np.float64) for f in FLOATS})
+    series = series[::-1]
+    return dict(
+        pair=np.full(len(series), series.pair),
+        interval=np.full(len(series), series.interval, dtype=np.int32),
+        datetime=series['minute'].astype('datetime64[m]').astype(
+            'datetime64[s]'),
+        **{f: series[f] for f in FLOATS})
+
+
+class CsvWriter(object):
+    """Write indicator rows as CSV."""
+
+    extension = 'csv'
+
+    def __init__(self, path, fieldnames):
+        self.dump = open(path, 'w')
+        self.writer = csv.DictWriter(
+            self.dump, fieldnames=fieldnames, extrasaction='ignore')
+        self.writer.writeheader()
+
+    def write(self, series):
+        """Append the rows of a series to the file, newest first."""
+        self.writer.writerows(series[::-1].rows())
+
+    def close(self):
+        """Flush and close the file."""
+        self.dump.close()
+
+
+class ParquetWriter(object):
+    """Write indicator rows as a Parquet file, one row group per call."""
+
+    extension = 'parquet'
+
+    def __init__(self, path, fieldnames=None):
+        self.path = path
+        self.writer = None
+
+    def write(self, series):
+        """Append a series as a new row group."""
+        if not series:
+            return
+        table = pa.table(columns(series))
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.path, table.schema,
+                                           compression='zstd')
+        self.writer.write_table(table)
+
+    def close(self):
+        """Write the footer, or an empty file when nothing was written."""
+        if self.writer is None:
+            pq.write_table(pa.table(columns()), self.path)
+        else:
+            self.writer.close()
+
+
+class NpzWriter(object):
+    """Write indicator rows as a compressed NumPy archive."""
+
+    extension = 'npz'
+
+    def __init__(self, path, fieldnames=None):
+        self.path = path
+        self.chunks = []
+
+    def write(self, series):
+        """Keep the columns of a series until the file closes."""
+        if series:
+            self.chunks.append(columns(series))
+
+    def close(self):
+        """Concatenate the columns and save them in a single archive."""
+        data = columns()
+        if self.chunks:
+            data = {k: np.concatenate([c[k] for c in self.chunks])
+                    for k in data}
+        with open(self.path, 'wb') as dump:
+            np.savez_compressed(dump, **data)
+
+
+WRITERS = {'csv': CsvWriter, 'npz': NpzWriter}
+if pq is not None:
+    WRITERS['parquet'] = ParquetWriter
@@ -1,23 +1,27 @@
 #!/usr/bin/python3
 """Scrapper for cryptocoins historical data."""
 import csv
+import io
 import logging
-import traceback
-from datetime import datetime
-from time import sleep
+import os
+from datetime import datetime, timedelta
+from itertools import islice
 
-import requests
+from bson.decimal128 import Decimal128
+from modules.fetcher import Fetcher
+from modules.rollups import rollup
+from modules.stats import track
+from modules.storage import collection, write as store
 
-from pymongo import MongoClient
+# Trade columns exported to CSV
+fieldnames = ['Id', 'Pair', 'TimeStamp', 'Quantity',
+              'Price', 'Total', 'FillType', 'OrderType']
 
-# Logger configuration
-logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s',
-                    level=logging.INFO, datefmt='%Y/%m/%dT%H:%M:%S')
+# Trade amounts stored as doubles, like the float64 indicator engine
+AMOUNTS = ['Quantity', 'Price', 'Total']
 
-# MongoDB client configuration
-client = MongoClient()
-db = client.bittrex
-collection = db.market
+# Last trade Id stored per pair, loaded lazily from the DB
+last_ids = {}
 
 # User-defined configuration
 coins_list =\
@@ -218,61 +222,136 @@ coins_list =\
 
 def timing(data):
     """Convert user-defined filter into DB time."""
-    return datetime.strptime(data,
-                             '%m/%d/%Y %I:%M %p').strftime('%Y-%m-%dT%H:%M:%S')
+    return filter_date(data).strftime('%Y-%m-%dT%H:%M:%S')
 
 
-def fetch(fromdate, todate, coin):
-    """Save a DB query result into CSV file."""
-    path = [timing(fromdate), timing(todate), coin]
-    result = list(db.market.find(
+def filter_date(data):
+    """Convert user-defined filter into a datetime."""
+    return datetime.strptime(data, '%m/%d/%Y %I:%M %p')
+
+
+def parse(stamp):
+    """Convert an API TimeStamp into a millisecond datetime."""
+    date, _, fraction = stamp.partition('.')
+    return datetime.strptime(date, '%Y-%m-%dT%H:%M:%S') + timedelta(
+        milliseconds=int(fraction[:3].ljust(3, '0')) if fraction else 0)
+
+
+def typed(trade):
+    """Return a trade with a BSON date TimeStamp and double amounts."""
+    data = dict(trade)
+    if isinstance(data['TimeStamp'], str):
+        data['TimeStamp'] = parse(data['TimeStamp'])
+    for field in AMOUNTS:
+        value = data[field]
+        data[field] = float(value.to_decimal() if isinstance(
+            value, Decimal128) else value)
+    return data
+
+
+def exported(trade):
+    """Format the TimeStamp of a stored trade for CSV and templates."""
+    stamp = trade['TimeStamp']
+    if isinstance(stamp, datetime):
+        stamp = stamp.isoformat(timespec='milliseconds')
+    return dict(trade, TimeStamp=stamp)
+
+
+def trades(fromdate, todate, coin, batch=1000):
+    """Return a cursor over the CSV columns of a pair's trades."""
+    return collection.find(
         {'TimeStamp':
          {
-             '$gt': path[0],
-             '$lt': path[1]
+             '$gt': filter_date(fromdate),
+             '$lt': filter_date(todate)
          },
          'Pair': 'BTC-{}'.format(coin)
-         }
-    ).sort([('TimeStamp', -1)]))
-    if not result:
-        logging.critical('No results found!')
-        return False
-    logging.info('{} results found, writing to CSV...'.format(len(result)))
+         },
+        dict({f: 1 for f in fieldnames}, _id=0)
+    ).sort([('TimeStamp', -1)]).batch_size(batch)
+
+
+def stream(fromdate, todate, coin, batch=1000):
+    """Yield a pair's trades as CSV text, one batch at a time."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    writer.writeheader()
+    cursor = trades(fromdate, todate, coin, batch)
+    while True:
+        rows = list(islice(cursor, batch))
+        writer.writerows(exported(r) for r in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        if len(rows) < batch:
+            break
+
+
+def fetch(fromdate, todate, coin, preview=100):
+    """Save a DB query result into CSV file."""
+    path = [timing(fromdate), timing(todate), coin]
     filepath = '-'.join(path)
+    count = 0
+    head = []
     with open('archive/{}.csv'.format(filepath), 'w') as dump:
-        fieldnames = ['Id', 'Pair', 'TimeStamp', 'Quantity',
-                      'Price', 'Total', 'FillType', 'OrderType']
-        writer = csv.DictWriter(
-            dump, fieldnames=fieldnames, extrasaction='ignore')
+        writer = csv.DictWriter(dump, fieldnames=fieldnames)
         writer.writeheader()
-        writer.writerows(result)
-    return (filepath, result)
+        for row in trades(fromdate, todate, coin):
+            row = exported(row)
+            writer.writerow(row)
+            if count < preview:
+                head.append(row)
+            count += 1
+    if not count:
+        os.remove('archive/{}.csv'.format(filepath))
+        logging.critical('No results found!')
+        return False
+    logging.info('{} results written to CSV.'.format(count))
+    return (filepath, count, head)
+
+
+def ingest(trades):
+    """Store unseen trades in a single unordered bulk write.
+
+    Trades may span several markets. Ids at or below the last one seen
+    for their pair are skipped before reaching the database, the others
+    are stored with typed fields and their minute bars rebuilt afterwards.
+    """
+    trades = [typed(t) for t in trades]
+    counts = {'inserted': 0, 'seen': 0}
+    fresh = []
+    for pair in {t['Pair'] for t in trades}:
+        if pair not in last_ids:
+            stored = collection.find_one({'Pair': pair}, {'Id': 1},
+                                         sort=[('Id', -1)])
+            last_ids[pair] = stored['Id'] if stored else 0
+    for t in trades:
+        if t['Id'] <= last_ids[t['Pair']]:
+            counts['seen'] += 1
+            continue
+        fresh.append(t)
+    if fresh:
+        inserted, matched = store(collection, fresh)
+        counts['inserted'] += len(inserted)
+        counts['seen'] += matched
+        for t in fresh:
+            last_ids[t['Pair']] = max(last_ids[t['Pair']], t['Id'])
+        # Bars first, so readers see them once the pair statistics move
+        rollup(fresh)
+        track(inserted)
+    return counts
 
 
 def write():
     """Create requests to the API and write data."""
-    for c in coins_list:
-        paired = 'BTC-{}'.format(c)
-        logging.info('Parsing [{}]'.format(c))
-        try:
-            ops = [{**o, 'Pair': paired} for o in requests.get(
-                   "https://bittrex.com/api/v1.1/public/" +
-                   "getmarkethistory?market={}".format(paired)
-                   ).json()['result']
-                   ]
-            logging.info('\tUpdating DB...')
-            [collection.update_one(
-             filter={'Id': i['Id'], 'Pair': i['Pair']},
-             update={'$set': i},
-             upsert=True
-             ) for i in ops
-             ]
-            logging.info('\tDone!')
-        except:
-            traceback.print_exc()
-            logging.warning('\tError parsing [{}]!'.format(c))
-        sleep(1)
+    fetcher = Fetcher(['BTC-{}'.format(c) for c in coins_list], ingest)
+    for pair, counts in fetcher.sweep().items():
+        if counts:
+            logging.info('[{}] {inserted} inserted, {seen} already seen.'
+                         .format(pair, **counts))
 
 
 if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s',
+                        level=logging.INFO, datefmt='%Y/%m/%dT%H:%M:%S')
     write()
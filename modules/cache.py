@@ -0,0 +1,165 @@
+#!/usr/bin/python3
+"""Content-addressed disk cache for computed indicator series."""
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import re
+import tempfile
+from collections import Counter
+from datetime import datetime
+from threading import Lock
+
+from modules.bittrex import timing
+from modules.helpers import INCREMENTAL
+from modules.stats import SETTLE, pairs
+
+CACHE_DIR = 'cache'
+# Least recently used entries are evicted beyond this size
+MAX_BYTES = 256 * 1024 * 1024
+
+counters = Counter()
+lock = Lock()
+
+
+def canonical(value):
+    """Normalize a form parameter so equal requests hash equally."""
+    if not value:
+        return None
+    value = str(value).strip()
+    if re.match(r'^\d{2}/\d{2}/\d{4} \d{1,2}:\d{2} (AM|PM)$', value):
+        return timing(value)
+    if value.isdigit():
+        return int(value)
+    return value
+
+
+def key(*params):
+    """Return the hex digest identifying a set of parameters."""
+    return hashlib.sha256(json.dumps(
+        [canonical(p) for p in params]).encode()).hexdigest()
+
+
+def closed(todate):
+    """Return True when no more trades can arrive before `todate`."""
+    end = datetime.strptime(todate, '%m/%d/%Y %I:%M %p')
+    return end + SETTLE < datetime.utcnow()
+
+
+def stat(coin):
+    """Return the last trade TimeStamp and revision time of a pair."""
+    return pairs.find_one({'_id': 'BTC-{}'.format(coin)},
+                          {'last': 1, 'revised': 1}) or {}
+
+
+def marker(coin):
+    """Return the last trade TimeStamp stored for a coin's pair."""
+    return stat(coin).get('last')
+
+
+def load(path):
+    """Return the cache entry at `path`, or None."""
+    try:
+        with open(path, 'rb') as dump:
+            return pickle.load(dump)
+    except Exception:
+        return None
+
+
+def evict():
+    """Remove least recently used entries beyond MAX_BYTES."""
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith('.pkl'):
+            continue
+        stat = os.stat(os.path.join(CACHE_DIR, name))
+        entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(e[1] for e in entries)
+    for mtime, size, name in sorted(entries):
+        if total <= MAX_BYTES:
+            break
+        os.remove(os.path.join(CACHE_DIR, name))
+        total -= size
+        counters['evictions'] += 1
+
+
+def store(path, entry):
+    """Atomically write a cache entry and trim the directory."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as dump:
+            pickle.dump(entry, dump)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+    with lock:
+        evict()
+
+
+def extended(func, interval, todate, coin, *params):
+    """Return an open date range, extending the saved state if any."""
+    series = INCREMENTAL[func.__name__]
+    path = os.path.join(CACHE_DIR, key(
+        func.__name__, interval, coin, *params) + '.pkl')
+    end = timing(todate)
+    pair = stat(coin)
+    current = pair.get('last')
+    taken = datetime.utcnow()
+    entry = load(path)
+    state = None
+    if entry is not None and pair.get('revised') and (
+            entry.get('taken') is None or pair['revised'] >= entry['taken']):
+        counters['revised'] += 1
+        entry = None
+    if entry is not None:
+        if entry['todate'] == end and entry['marker'] == current:
+            os.utime(path)
+            counters['hits'] += 1
+            return entry['value']
+        if entry['todate'] <= end:
+            counters['extended'] += 1
+            state = entry['state']
+        else:
+            counters['misses'] += 1
+    else:
+        counters['misses'] += 1
+    value, state = series(interval, todate, coin, *params, state=state)
+    store(path, {'todate': end, 'marker': current, 'taken': taken,
+                 'value': value, 'state': state})
+    return value
+
+
+def cached(func, interval, todate, coin, *params):
+    """Return func(interval, todate, coin, *params) through the cache."""
+    final = closed(todate)
+    # Open date ranges are keyed without their end and extended
+    if not final and func.__name__ in INCREMENTAL and inspect.signature(
+            func).bind(interval, todate, coin, *params).arguments.get(
+                'fromdate'):
+        return extended(func, interval, todate, coin, *params)
+    path = os.path.join(CACHE_DIR, key(
+        func.__name__, interval, todate, coin, *params) + '.pkl')
+    entry = load(path)
+    if entry is not None:
+        if final or entry['marker'] == marker(coin):
+            os.utime(path)
+            counters['hits'] += 1
+            return entry['value']
+        counters['stale'] += 1
+    counters['misses'] += 1
+    current = None if final else marker(coin)
+    value = func(interval, todate, coin, *params)
+    store(path, {'marker': current, 'value': value})
+    return value
+
+
+def stats():
+    """Return hit, miss and size counters of the cache."""
+    entries = os.listdir(CACHE_DIR) if os.path.isdir(CACHE_DIR) else []
+    return dict(counters,
+                entries=len(entries),
+                bytes=sum(os.path.getsize(os.path.join(CACHE_DIR, e))
+                          for e in entries))
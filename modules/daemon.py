@@ -0,0 +1,101 @@
+#!/usr/bin/python3
+"""Continuous ingestion service for Bittrex market histories.
+
+Run with `python -m modules.daemon`. Every market keeps a high-water mark
+(last Id and TimeStamp) in the `marks` collection, so a restarted daemon
+resumes from where it stopped and a poll whose oldest trade is already
+past the mark is counted as a gap.
+"""
+import argparse
+import logging
+import signal
+from datetime import datetime
+from threading import Event, Thread
+
+from modules.bittrex import coins_list, ingest, last_ids, typed
+from modules.database import db
+from modules.fetcher import Fetcher
+from modules.stats import moment
+
+marks = db.marks
+
+
+def lag(timestamp):
+    """Return seconds elapsed since a trade TimeStamp."""
+    return (datetime.utcnow() - moment(timestamp)).total_seconds()
+
+
+def resume():
+    """Seed the ingester with the stored high-water marks."""
+    for mark in marks.find({}, {'Id': 1}):
+        last_ids[mark['_id']] = max(last_ids.get(mark['_id'], 0), mark['Id'])
+    return len(last_ids)
+
+
+def record(trades):
+    """Ingest trades of a market and advance its high-water mark."""
+    if not trades:
+        return ingest(trades)
+    trades = [typed(t) for t in trades]
+    pair = trades[0]['Pair']
+    previous = last_ids.get(pair)
+    counts = ingest(trades)
+    oldest = min(trades, key=lambda t: t['Id'])
+    newest = max(trades, key=lambda t: t['Id'])
+    counts['gap'] = previous is not None and oldest['Id'] > previous
+    if counts['gap']:
+        logging.warning('[{}] Gap: oldest polled trade {} is past mark {}!'
+                        .format(pair, oldest['Id'], previous))
+    marks.update_one(
+        {'_id': pair},
+        {'$max': {'Id': newest['Id'], 'TimeStamp': newest['TimeStamp']},
+         '$set': {'polled': datetime.utcnow(),
+                  'lag': lag(newest['TimeStamp'])},
+         '$inc': {'polls': 1,
+                  'inserted': counts['inserted'],
+                  'gaps': int(counts['gap'])}},
+        upsert=True)
+    return counts
+
+
+def status():
+    """Return per-market lag and gap metrics sorted by lag."""
+    return list(marks.find().sort([('lag', -1)]))
+
+
+def summary(stop, every):
+    """Log aggregated ingestion metrics until `stop` is set."""
+    while not stop.wait(every):
+        stats = status()
+        if not stats:
+            continue
+        logging.info('{} markets, max lag {:.0f}s, {} gaps, {} inserted'
+                     .format(len(stats), stats[0].get('lag', 0),
+                             sum(s.get('gaps', 0) for s in stats),
+                             sum(s.get('inserted', 0) for s in stats)))
+
+
+def serve(rate=5.0, workers=8, every=60):
+    """Poll all markets until SIGINT or SIGTERM, then stop cleanly."""
+    stop = Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stop.set())
+    logging.info('Resumed {} markets from their marks.'.format(resume()))
+    Thread(target=summary, args=(stop, every), daemon=True).start()
+    fetcher = Fetcher(['BTC-{}'.format(c) for c in coins_list], record,
+                      rate=rate, workers=workers)
+    fetcher.run(stop)
+    logging.info('Ingestion stopped.')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rate', type=float, default=5.0,
+                        help='API requests per second')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--every', type=int, default=60,
+                        help='seconds between metric summaries')
+    args = parser.parse_args()
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s',
+                        level=logging.INFO, datefmt='%Y/%m/%dT%H:%M:%S')
+    serve(args.rate, args.workers, args.every)
@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+"""Shared, lazily created MongoDB client of the process."""
+import os
+from threading import Lock
+
+from pymongo import MongoClient
+from pymongo.database import Database
+
+# Connection settings read from the environment
+URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017')
+NAME = os.environ.get('MONGO_DATABASE', 'bittrex')
+OPTIONS = {
+    'maxPoolSize': int(os.environ.get('MONGO_POOL_SIZE', 20)),
+    'serverSelectionTimeoutMS': int(os.environ.get('MONGO_TIMEOUT_MS',
+                                                   5000)),
+    'connectTimeoutMS': int(os.environ.get('MONGO_TIMEOUT_MS', 5000)),
+    'socketTimeoutMS': os.environ.get('MONGO_SOCKET_TIMEOUT_MS') and int(
+        os.environ['MONGO_SOCKET_TIMEOUT_MS']),
+    'readPreference': os.environ.get('MONGO_READ_PREFERENCE', 'primary'),
+}
+
+shared = None
+lock = Lock()
+
+
+def client():
+    """Return the shared client, creating it on first use."""
+    global shared
+    if shared is None:
+        with lock:
+            if shared is None:
+                shared = MongoClient(URI, **OPTIONS)
+    return shared
+
+
+def forget():
+    """Drop the parent's client and lock in a forked child."""
+    global shared, lock
+    shared = None
+    lock = Lock()
+
+
+# pymongo clients are not fork-safe
+os.register_at_fork(after_in_child=forget)
+
+
+class Lazy(object):
+    """A database or collection resolved on the shared client when used."""
+
+    def __init__(self, name=None):
+        self.name = name or NAME
+        self._collection = name is not None
+        self._owner = self._target = None
+
+    def resolve(self):
+        """Return the pymongo database or collection."""
+        current = client()
+        if self._owner is not current:
+            database = current[NAME]
+            self._target = database[self.name] if self._collection \
+                else database
+            self._owner = current
+        return self._target
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if not self._collection and not hasattr(Database, name):
+            return Lazy(name)
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, name):
+        if self._collection:
+            return self.resolve()[name]
+        return Lazy(name)
+
+    def __repr__(self):
+        return 'Lazy({!r})'.format(self.name)
+
+
+db = Lazy()
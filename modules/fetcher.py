@@ -0,0 +1,123 @@
+#!/usr/bin/python3
+"""Concurrent, rate-limited market history fetcher."""
+import heapq
+import logging
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from threading import Event, Lock
+from time import monotonic, sleep
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = 'https://bittrex.com/api/v1.1/public/'
+
+
+class RateLimiter(object):
+    """Spread requests evenly to stay within a global rate budget."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.lock = Lock()
+        self.slot = monotonic()
+
+    def wait(self):
+        """Block until the caller may send its request."""
+        with self.lock:
+            now = monotonic()
+            slot = max(self.slot, now)
+            self.slot = slot + self.interval
+        sleep(max(0.0, slot - now))
+
+
+class Fetcher(object):
+    """Poll market histories from a thread pool over pooled connections.
+
+    Each market is rescheduled from the share of new trades its last poll
+    returned: busy pairs are polled more often, quiet ones back off.
+    """
+
+    def __init__(self, pairs, ingest=None, rate=5.0, workers=8,
+                 base_url=API_URL, timeout=10, min_interval=2.0,
+                 max_interval=120.0, retries=2, backoff=0.5):
+        self.pairs = list(pairs)
+        self.ingest = ingest
+        self.limiter = RateLimiter(rate)
+        self.workers = workers
+        self.base_url = base_url
+        self.timeout = timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.session = requests.Session()
+        # Throttled and failing requests are retried with backoff
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers,
+                              max_retries=Retry(
+                                  total=retries, backoff_factor=backoff,
+                                  status_forcelist=[429, 500, 502, 503, 504],
+                                  allowed_methods=['GET']))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.intervals = {p: min_interval for p in self.pairs}
+        self.queue = [(0.0, p) for p in self.pairs]
+        heapq.heapify(self.queue)
+
+    def history(self, pair):
+        """Return the latest trades of a market tagged with their pair."""
+        self.limiter.wait()
+        response = self.session.get(
+            self.base_url + 'getmarkethistory',
+            params={'market': pair}, timeout=self.timeout)
+        response.raise_for_status()
+        return [{**o, 'Pair': pair} for o in response.json()['result'] or []]
+
+    def poll(self, pair):
+        """Fetch and ingest one market, then adapt its polling interval."""
+        try:
+            trades = self.history(pair)
+            if self.ingest:
+                counts = self.ingest(trades)
+            else:
+                counts = {'inserted': len(trades), 'seen': 0}
+        except Exception:
+            traceback.print_exc()
+            logging.warning('\tError parsing [{}]!'.format(pair))
+            return None
+        self.reschedule(pair, counts['inserted'], len(trades))
+        return counts
+
+    def reschedule(self, pair, fresh, total):
+        """Shorten the interval of busy markets and stretch quiet ones."""
+        interval = self.intervals[pair]
+        if total and fresh >= total / 2:
+            interval /= 2
+        elif fresh <= total / 10:
+            interval *= 1.5
+        self.intervals[pair] = min(max(interval, self.min_interval),
+                                   self.max_interval)
+
+    def sweep(self):
+        """Poll every market once and return counts keyed by pair."""
+        with ThreadPoolExecutor(self.workers) as executor:
+            return dict(zip(self.pairs, executor.map(self.poll, self.pairs)))
+
+    def run(self, stop=None):
+        """Poll markets as they fall due until `stop` is set."""
+        stop = stop or Event()
+        with ThreadPoolExecutor(self.workers) as executor:
+            pending = {}
+            while not stop.is_set():
+                now = monotonic()
+                while self.queue and self.queue[0][0] <= now:
+                    pair = heapq.heappop(self.queue)[1]
+                    pending[executor.submit(self.poll, pair)] = pair
+                timeout = self.queue[0][0] - now if self.queue else None
+                if not pending:
+                    stop.wait(timeout)
+                    continue
+                done = wait(pending, timeout=timeout,
+                            return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    pair = pending.pop(future)
+                    heapq.heappush(
+                        self.queue, (monotonic() + self.intervals[pair], pair))
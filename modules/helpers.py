@@ -1,18 +1,28 @@
 #!/usr/bin/python3
 """Helpers func for Bittrex Flask app."""
-import csv
+import heapq
+import logging
 import re
+from copy import deepcopy
 from datetime import datetime, timedelta
-from decimal import Decimal
+from itertools import groupby
 
-from bson.son import SON
-from pymongo import MongoClient
+import numpy as np
 
+from modules.archive import WRITERS
 from modules.bittrex import coins_list, timing
+from modules.indicators import Macd, Momentum
+from modules.metrics import span
+from modules.rollups import resolution
+from modules.series import BarSeries, filled, labels, minutes
+from modules.stats import SETTLE, report
 
-connection = MongoClient()
-db = connection.bittrex
-collection = db.market
+
+# Columns of the datacenter CSV reports
+report_fields = ['pair', 'interval', 'datetime', 'date',
+                 'time', 'volume',
+                 'price', 'ema_fast', 'ema_slow', 'macd',
+                 'signal_line', 'macd_hist']
 
 
 def tabulizer(filename):
@@ -23,8 +33,10 @@ def tabulizer(filename):
             '^\d{4}-\d{2}-\d{2}T\d{2}-\d{2}', filename)[0]
         data['to'] = re.findall(
             '-(\d{4}-\d{2}-\d{2}T\d{2}-\d{2})', filename)[0]
-        data['coin'] = re.findall('(\w{3,})-\d+\.csv', filename)[0]
-        data['interval'] = re.findall('(\d+)\.csv$', filename)[0]
+        (data['coin'], data['interval'], data['params'],
+         data['format']) = re.findall(
+            r'(\w+?)-(\d+)(?:-(\d+-\d+-\d+))?\.(csv|parquet|npz)$',
+            filename)[0]
         data['filename'] = filename
         return data
     except:
@@ -48,355 +60,228 @@ def to_string(date):
 
 def get_report():
     """Get MongoDB report."""
-    report = {}
-    try:
-        report['count'] = collection.find().count()
-        report['from'] = list(collection.find().sort(
-            [('TimeStamp', 1)]).limit(1))[0]['TimeStamp']
-        report['to'] = list(collection.find().sort(
-            [('TimeStamp', -1)]).limit(1))[0]['TimeStamp']
-    except:
-        pass
-    return report or False
-
-
-def datacenter_report(interval, todate, coin, fast, slow, signal, fromdate):
-    """Generate report and CSV file for datacenter endpoint."""
-    if coin:
-        path = [timing(fromdate), timing(todate), coin, str(interval)]
+    return report()
+
+
+def report_path(interval, todate, coin, fast, slow, signal, fromdate):
+    """Return the archive filename of a datacenter report."""
+    path = [timing(fromdate), timing(todate), coin or 'ALL', str(interval),
+            str(fast), str(slow), str(signal)]
+    return '-'.join(path).replace(':', '-')
+
+
+def datacenter_report(interval, todate, coin, fast, slow, signal, fromdate,
+                      fmt='csv'):
+    """Generate report and archive file for datacenter endpoint."""
+    filepath = report_path(interval, todate, coin, fast, slow, signal,
+                           fromdate)
+    writer = WRITERS[fmt]('archive/{}.{}'.format(
+        filepath, WRITERS[fmt].extension), report_fields)
+    if coin or not fromdate:
+        # Latest windows read each coin's last 67 buckets like summarize()
+        partitions = [(c, None) for c in ([coin] if coin else coins_list)]
     else:
-        path = [timing(fromdate), timing(todate), 'ALL', str(interval)]
-    filepath = '-'.join(path).replace(':', '-')
-    with open('archive/{}.csv'.format(filepath), 'w') as dump:
-        fieldnames = ['pair', 'interval', 'datetime', 'date',
-                      'time', 'volume',
-                      'price', 'ema_fast', 'ema_slow', 'macd',
-                      'signal_line', 'macd_hist']
-        writer = csv.DictWriter(
-            dump, fieldnames=fieldnames, extrasaction='ignore')
-        writer.writeheader()
-        if coin:
-            [writer.writerow(i) for i in summarize(
-                interval, todate, coin, fast, slow, signal, fromdate)]
-        else:
-            for c in coins_list:
-                try:
-                    [writer.writerow(i) for i in summarize(
-                        interval, todate, c, fast, slow, signal, fromdate)]
-                except:
-                    pass
+        partitions = scan(interval, todate, fromdate)
+    for c, series in partitions:
+        try:
+            if series is None:
+                series = points(interval, todate, c, fromdate)
+            if not fromdate:
+                series = series[-67:]
+            result = signals(series, interval, c, fast, slow, signal,
+                             fromdate)
+            if result:
+                writer.write(result)
+        except Exception:
+            logging.exception('Error summarizing [{}]!'.format(c))
+    writer.close()
     return filepath
 
 
 def three_graphs(interval, todate, coin, fromdate):
     """Generate three additional graphs."""
-    b = points(interval, todate, coin, fromdate)
-    if not b:
-        return False
+    return momentum_series(interval, todate, coin, fromdate)[0]
 
-    # Setting initial values
-    generator = b[::interval]
-
-    period = 14
-    alpha = Decimal(1) / Decimal(period)
-    alpha_1 = Decimal(1) - Decimal(alpha)
-
-    first_iteration = []
-    for f in generator:
-        position = generator.index(f)
-        data = {}
-        data['pair'] = coin
-        data['datetime'] = f['datetime']
-        data['price'] = Decimal(f['price'])
-        data['volume'] = Decimal(f['sum_quantity'])
-        if position == 0:
-            data['u'] = data['price']
-            data['d'] = Decimal(0)
-            data['updown'] = Decimal(1)
-        else:
-            data['u'] = max(
-                [data['price'] - Decimal(generator[position - 1]['price']),
-                 Decimal(0)])
-            data['d'] = max(
-                [-(data['price'] - Decimal(generator[position - 1]['price'])),
-                 Decimal(0)
-                 ])
-            if data['price'] > Decimal(generator[position - 1]['price']):
-                data['updown'] = Decimal(1)
-            else:
-                data['updown'] = Decimal(-1)
-        data['smmau'] = alpha * data['u']
-        data['smmad'] = alpha * data['d']
-        data['volpm'] = data['updown'] * data['volume'] / data['price']
-        if position < 25:
-            if position > 0:
-                prices = generator[0:position][::-1]
-            else:
-                prices = [generator[0]]
-        else:
-            prices = generator[position - 24:position][::-1]
-        prices = [Decimal(i['price']) for i in prices]
-        data['aroonup'] = (Decimal(25) - (prices.index(
-            max([i for i in prices])) + Decimal(1))
-        ) / Decimal(25) * Decimal(100)
-        data['aroondown'] = (Decimal(25) - (prices.index(
-            min([i for i in prices])) + Decimal(1))
-        ) / Decimal(25) * Decimal(100)
-        first_iteration.append(data.copy())
-
-    second_iteration = []
-    for s in first_iteration:
-        position = first_iteration.index(s)
-        second = s.copy()
-        if position == 0:
-            second['smmau'] = s['smmau'] + alpha_1
-            second['smmad'] = s['smmad'] + alpha_1
-            second['obv'] = s['volpm']
-        else:
-            second['obv'] = sum([s['volpm']] + [i['volpm']
-                                                for i in second_iteration])
-            second['smmau'] = s['smmau'] + \
-                (alpha_1 * second_iteration[position - 1]['smmau'])
-            second['smmad'] = s['smmad'] + \
-                (alpha_1 * second_iteration[position - 1]['smmad'])
-        second['rs'] = second['smmau'] / second['smmad']
-        second['rsi'] = Decimal(100) - (Decimal(100) /
-                                        (Decimal(1) + second['rs']))
-        second_iteration.append(second.copy())
-
-    return second_iteration
-
-
-def points(interval, todate, coin, fromdate=False):
-    """Generate straight points interval."""
-    coin = 'BTC-' + coin
+
+def momentum_columns(engine, series):
+    """Fold buckets into a Momentum engine and add its columns."""
+    with span('indicators'):
+        return series.extend(engine.extend(series['price'],
+                                           series['volume']))
+
+
+def momentum_series(interval, todate, coin, fromdate, state=None):
+    """Return three_graphs() series and the state to extend it."""
     if not fromdate:
-        limits = interval * 66
-        pipeline =\
-            [{"$match":
-              {'TimeStamp':
-               {"$lt":
-                (datetime.strptime(todate,
-                                   '%m/%d/%Y %I:%M %p'
-                                   ) + timedelta(minutes=1)
-                 ).strftime('%Y-%m-%dT%H:%M')},
-               'Pair': coin
-               }
-              },
-             {"$group":
-                {"_id":
-                 {'datehours':
-                  {"$arrayElemAt":
-                   [
-                       {"$split":
-                        ["$TimeStamp",
-                         ':'
-                         ]
-                        }, 0]
-                   },
-                  'minutes':
-                  {"$arrayElemAt":
-                   [
-                       {"$split":
-                        ["$TimeStamp", ':']
-                        }, 1]
-                   }
-                  },
-                 "sum_quantity":
-                 {
-                     "$sum":
-                     "$Quantity"
-                 },
-                 "sum_total":
-                 {
-                     "$sum":
-                     "$Total"
-                 }
-                 }
-              },
-             {"$project":
-              {"_id": 1,
-               "sum_quantity": 1,
-               "sum_total": 1,
-               "price":
-               {"$divide":
-                [
-                    "$sum_total",
-                    "$sum_quantity"
-                ]
-                }
-               }
-              },
-             {"$sort": SON([("_id", -1)])
-              },
-             {"$limit": limits}
-             ]
-    else:
-        pipeline =\
-            [{"$match":
-              {'TimeStamp':
-               {"$lt":
-                (datetime.strptime(todate,
-                                   '%m/%d/%Y %I:%M %p'
-                                   ) + timedelta(minutes=1)
-                 ).strftime('%Y-%m-%dT%H:%M'),
-                "$gte":
-                datetime.strptime(fromdate,
-                                  '%m/%d/%Y %I:%M %p'
-                                  ).strftime('%Y-%m-%dT%H:%M')},
-               'Pair': coin
-               }
-              },
-             {"$group":
-                {"_id":
-                 {'datehours':
-                  {"$arrayElemAt":
-                   [
-                       {"$split":
-                        ["$TimeStamp",
-                         ':'
-                         ]
-                        }, 0]
-                   },
-                  'minutes':
-                  {"$arrayElemAt":
-                   [
-                       {"$split":
-                        ["$TimeStamp", ':']
-                        }, 1]
-                   }
-                  },
-                 "sum_quantity":
-                 {
-                     "$sum":
-                     "$Quantity"
-                 },
-                 "sum_total":
-                 {
-                     "$sum":
-                     "$Total"
-                 }
-                 }
-              },
-             {"$project":
-              {"_id": 1,
-               "sum_quantity": 1,
-               "sum_total": 1,
-               "price":
-               {"$divide":
-                [
-                    "$sum_total",
-                    "$sum_quantity"
-                ]
-                }
-               }
-              },
-             {"$sort": SON([("_id", -1)])
-              }
-             ]
-    generator = list(collection.aggregate(pipeline))
-    if generator:
-        b = []
-        for i in generator[::-1]:
-            i['datetime'] = i['_id']['datehours'] + \
-                ':' + i['_id']['minutes']
-            if generator[::-1].index(i) == 0:
-                b.append(i.copy())
-                continue
-            position = b.index(b[-1])
-            difference = to_date(i['datetime']) -\
-                to_date(b[position]['datetime'])
-            if int(difference.total_seconds()) / 60 > 1:
-                price = b[position]['price']
-                base = to_date(i['datetime'])
-                date_list = [
-                    base - timedelta(minutes=x + 1)
-                    for x in range(0, int(difference.total_seconds() / 60
-                                          ) - 1)
-                ][::-1]
-                for d in date_list:
-                    b.append({'datetime': to_string(d),
-                              'price': price,
-                              'sum_quantity': 0})
-            b.append(i.copy())
-        return b
-    return False
+        return momentum_columns(Momentum(), points(
+            interval, todate, coin)) or False, None
+    result, state = incremental(Momentum(), momentum_columns, interval,
+                                todate, coin, fromdate, state)
+    return result or False, state
+
+
+def settled(series, interval):
+    """Return the number of leading buckets no trade can change anymore."""
+    horizon = minutes(to_string(datetime.utcnow() - SETTLE -
+                                timedelta(minutes=interval)))
+    return int(np.searchsorted(series['minute'], horizon))
+
+
+def incremental(engine, build, interval, todate, coin, fromdate, state=None):
+    """Fold only the buckets newer than a saved engine state."""
+    # The state snapshots the engine and series up to the last settled
+    # bucket; only later buckets are read, then the snapshot moves on
+    kept, resume = None, None
+    if state:
+        engine, kept, resume = deepcopy(state['engine']), state['series'], \
+            state['resume']
+    series = points(interval, todate, coin, fromdate, resume)
+    head = settled(series, interval)
+    done = build(engine, series[:head])
+    if kept is not None:
+        done = BarSeries.concat([kept, done])
+    if len(done):
+        resume = int(done['minute'][-1]), float(done['price'][-1])
+    state = {'engine': deepcopy(engine), 'series': done, 'resume': resume}
+    return BarSeries.concat([done, build(engine, series[head:])]), state
+
+
+def window(todate, fromdate):
+    """Return the epoch minutes [start, end) of a form date range."""
+    end = int(minutes(datetime.strptime(
+        todate, '%m/%d/%Y %I:%M %p').strftime('%Y-%m-%dT%H:%M'))) + 1
+    start = None
+    if fromdate:
+        start = int(minutes(datetime.strptime(
+            fromdate, '%m/%d/%Y %I:%M %p').strftime('%Y-%m-%dT%H:%M')))
+    return start, end
+
+
+def bounds(start, end, size):
+    """Return the (bars, minute filter) queries covering [start, end)."""
+    # Coarse bars only where they lie entirely within the range, so the
+    # partial edge buckets are clipped from the minute bars
+    coarse = resolution(size)[1]
+    fine = resolution(1)[1]
+    inner = end - end % size
+    head = None if start is None else min(start + -start % size, inner)
+    if head is not None and head >= inner:
+        head = inner = end
+    queries = []
+    if start is not None and start < head:
+        queries.append((fine, {'$gte': labels([start])[0],
+                               '$lt': labels([head])[0]}))
+    if head is None or head < inner:
+        minute = {'$lt': labels([inner])[0]}
+        if head is not None:
+            minute['$gte'] = labels([head])[0]
+        queries.append((coarse, minute))
+    if inner < end:
+        queries.append((fine, {'$gte': labels([inner])[0],
+                               '$lt': labels([end])[0]}))
+    return queries
+
+
+def buckets(bars, interval, pair=None, last=None, price=None):
+    """Merge chronological bars into a gap-filled `interval` series."""
+    bars = list(bars)
+    if not bars:
+        return BarSeries.empty(pair, interval)
+    minute = minutes([b['minute'] for b in bars])
+    minute -= minute % interval
+    starts = np.flatnonzero(np.diff(minute, prepend=-1))
+    volume = np.add.reduceat(np.array([b['volume'] for b in bars],
+                                      dtype=np.float64), starts)
+    total = np.add.reduceat(np.array([b['total'] for b in bars],
+                                     dtype=np.float64), starts)
+    close = np.array([b['close'] for b in bars],
+                     dtype=np.float64)[np.append(starts[1:], len(bars)) - 1]
+    # Buckets without volume are priced at their last close
+    vwap = np.divide(total, volume, out=close, where=volume != 0)
+    minute, vwap, volume = filled(minute[starts], vwap, volume, interval,
+                                  last, price)
+    return BarSeries(minute, {'price': vwap, 'volume': volume}, pair,
+                     interval)
+
+
+# Bar fields read by buckets()
+FIELDS = {'_id': 0, 'Pair': 1, 'minute': 1, 'volume': 1, 'total': 1,
+          'close': 1}
+
+
+def points(interval, todate, coin, fromdate=False, resume=None):
+    """Return the gap-filled `interval` buckets of a coin as a BarSeries."""
+    # `resume` is the (epoch minute, price) of the last bucket already seen
+    size = resolution(interval)[0]
+    start, end = window(todate, fromdate)
+    last = price = None
+    if resume:
+        last, price = resume
+        start = last + interval
+    rows = []
+    with span('query'):
+        for bars, minute in bounds(start, end, size):
+            query = {'Pair': 'BTC-' + coin, 'minute': minute}
+            if '$gte' in minute:
+                rows += bars.find(query, FIELDS).sort([('minute', 1)])
+            else:
+                rows += list(bars.find(query, FIELDS).sort(
+                    [('minute', -1)]).limit(interval // size * 67))[::-1]
+    with span('buckets'):
+        return buckets(rows, interval, coin, last, price)
+
+
+def scan(interval, todate, fromdate, coins=coins_list):
+    """Yield (coin, buckets) for every coin from a single bar scan."""
+    pairs = {'$in': ['BTC-' + c for c in coins]}
+    cursors = [bars.find({'Pair': pairs, 'minute': minute}, FIELDS).sort(
+        [('Pair', 1), ('minute', 1)])
+        for bars, minute in bounds(*window(todate, fromdate),
+                                   resolution(interval)[0])]
+    merged = heapq.merge(*cursors, key=lambda b: (b['Pair'], b['minute']))
+    for pair, group in groupby(merged, key=lambda b: b['Pair']):
+        yield pair[4:], buckets(group, interval, pair[4:])
 
 
 def summarize(interval, todate, coin, fast, slow, signal, fromdate=False):
     """Get the graph generated."""
-    b = points(interval, todate, coin, fromdate)
-    if not b:
-        return False
-    summarized = None
-    if not fromdate:
-        generator = b[::-1][:interval * 67][::interval]
-        summarized = generator[:40]
-        ema_basic_slow =\
-            sum([Decimal(i['price']) for i in generator[41:]])\
-            / Decimal(len(generator[41:]))
-        ema_basic_fast =\
-            sum([Decimal(i['price']) for i in generator[41:53]])\
-            / Decimal(len(generator[41:53]))
-    else:
-        generator = b[::interval][::-1]
-        summarized = generator
-    alphafast = Decimal(2.0 / (1.0 + float(fast)))
-    alphaslow = Decimal(2.0 / (1.0 + float(slow)))
-    alphasignal = Decimal(2.0 / (1.0 + float(signal)))
-
-    alphafast_1 = Decimal(1.0) - alphafast
-    alphaslow_1 = Decimal(1.0) - alphaslow
-    alphasignal_1 = Decimal(1.0) - alphasignal
-
-    first_generation = []
-    for m in summarized:
-        data = {}
-        data['pair'] = coin
-        data['interval'] = '{}-Minute'.format(interval)
-        data['datetime'] = m['datetime']
-        data['date'] = m['datetime'].split('T')[0]
-        data['time'] = m['datetime'].split('T')[1]
-        data['price'] = Decimal(m['price'])
-        data['volume'] = Decimal(m['sum_quantity'])
-        data['ema_fast'] = alphafast * Decimal(data['price'])
-        data['ema_slow'] = alphaslow * Decimal(data['price'])
-        first_generation.append(data.copy())
+    if fromdate:
+        return macd_series(interval, todate, coin, fast, slow, signal,
+                           fromdate)[0]
+    series = points(interval, todate, coin)[-67:]
+    return signals(series, interval, coin, fast, slow, signal)
 
+
+def macd_columns(engine, series):
+    """Fold buckets into a Macd engine and add its columns."""
+    with span('indicators'):
+        return series.extend(engine.extend(series['price']))
+
+
+def macd_series(interval, todate, coin, fast, slow, signal, fromdate,
+                state=None):
+    """Return date-range summarize() series and the state to extend it."""
+    result, state = incremental(Macd(fast, slow, signal), macd_columns,
+                                interval, todate, coin, fromdate, state)
+    return result or False, state
+
+
+def signals(series, interval, coin, fast, slow, signal, fromdate=False):
+    """Compute the MACD series of chronological buckets."""
+    # Latest windows report 40 buckets, EMAs seeded by the ones before
+    if not series:
+        return False
+    seed_fast = seed_slow = 0.0
     if not fromdate:
-        first_generation.append(
-            {'ema_fast': ema_basic_fast, 'ema_slow': ema_basic_slow})
-
-    second_generation = []
-    for g in first_generation[::-1]:
-        position = first_generation[::-1].index(g)
-        data = g.copy()
-        if position > 0:
-            data['ema_fast'] = data['ema_fast'] + alphafast_1 * \
-                second_generation[position - 1]['ema_fast']
-            data['ema_slow'] = data['ema_slow'] + alphaslow_1 * \
-                second_generation[position - 1]['ema_slow']
-        second_generation.append(data.copy())
-
-    third_generation = []
-    if not fromdate:
-        indexation = 1
-    else:
-        indexation = 0
-    for t in second_generation[indexation:]:
-        data = t.copy()
-        data['macd'] = data['ema_fast'] - data['ema_slow']
-        data['signal_line'] = alphasignal * data['macd']
-        third_generation.append(data.copy())
-
-    fourth_generation = []
-    for f in third_generation:
-        position = third_generation.index(f)
-        data = f.copy()
-        if position > 0:
-            data['signal_line'] = data['signal_line'] + alphasignal_1 * \
-                fourth_generation[position - 1]['signal_line']
-        data['macd_hist'] = data['macd'] - data['signal_line']
-        fourth_generation.append(data.copy())
-
-    return fourth_generation[::-1]
+        if len(series) < 42:
+            return False
+        prices = series['price']
+        seed_slow = prices[:-41].sum() / len(prices[:-41])
+        seed_fast = prices[-53:-41].sum() / len(prices[-53:-41])
+        series = series[-40:]
+    return macd_columns(Macd(fast, slow, signal, seed_fast, seed_slow),
+                        series)
+
+
+# Date-range computations that cache.cached() extends from a saved state
+INCREMENTAL = {'summarize': macd_series, 'three_graphs': momentum_series}
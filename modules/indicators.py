@@ -0,0 +1,156 @@
+#!/usr/bin/python3
+"""Vectorized indicator engine for Bittrex Flask app.
+
+Series are held as float64 arrays in chronological order. Results match
+the former Decimal implementation within 1e-9 of the price level: the
+smoothing factors were always derived from floats, so the only difference
+left is float64 rounding of prices and running sums.
+"""
+from collections import deque
+
+import numpy as np
+
+# Largest growth factor allowed inside a single closed-form EMA block
+BLOCK_GROWTH = 1e100
+
+
+def alpha(period):
+    """Return EMA smoothing factor for the given period."""
+    return 2.0 / (1.0 + float(period))
+
+
+def ema(values, factor, seed=0.0):
+    """Run y[i] = factor * x[i] + (1 - factor) * y[i - 1] over an array.
+
+    The recursion starts from `seed`, so the default reproduces the
+    zero-seeded EMA used when a date range is requested. It is computed
+    in closed form block by block, which keeps the scaling terms
+    bounded by BLOCK_GROWTH.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    decay = 1.0 - factor
+    if not len(values):
+        return values.copy()
+    if decay <= 0.0:
+        return factor * values
+    size = max(1, int(np.log(BLOCK_GROWTH) / -np.log(decay)))
+    result = np.empty_like(values)
+    last = float(seed)
+    for start in range(0, len(values), size):
+        block = values[start:start + size]
+        powers = decay ** np.arange(1, len(block) + 1)
+        result[start:start + len(block)] = powers * (
+            last + np.cumsum(factor * block / powers))
+        last = result[start + len(block) - 1]
+    return result
+
+
+class Macd(object):
+    """Resumable MACD engine keeping its EMAs and signal line as state."""
+
+    def __init__(self, fast, slow, signal, seed_fast=0.0, seed_slow=0.0):
+        self.alphas = (alpha(fast), alpha(slow), alpha(signal))
+        self.ema_fast = float(seed_fast)
+        self.ema_slow = float(seed_slow)
+        self.signal_line = 0.0
+
+    def extend(self, prices):
+        """Fold new prices and return their indicator columns."""
+        prices = np.asarray(prices, dtype=np.float64)
+        ema_fast = ema(prices, self.alphas[0], self.ema_fast)
+        ema_slow = ema(prices, self.alphas[1], self.ema_slow)
+        line = ema_fast - ema_slow
+        signal_line = ema(line, self.alphas[2], self.signal_line)
+        if len(prices):
+            self.ema_fast = ema_fast[-1]
+            self.ema_slow = ema_slow[-1]
+            self.signal_line = signal_line[-1]
+        return {'price': prices,
+                'ema_fast': ema_fast,
+                'ema_slow': ema_slow,
+                'macd': line,
+                'signal_line': signal_line,
+                'macd_hist': line - signal_line}
+
+
+class Aroon(object):
+    """Sliding Aroon up/down over the bars preceding the current one.
+
+    The window keeps the previous `period - 1` bars in two monotonic deques,
+    so the most recent maximum and minimum are found in O(1) amortized time.
+    """
+
+    def __init__(self, period=25):
+        self.period = period
+        self.position = 0
+        self.highs = deque()
+        self.lows = deque()
+
+    def update(self, price):
+        """Add a bar and return its (aroonup, aroondown) values."""
+        position = self.position
+        if position:
+            up = position - self.highs[0][0]
+            down = position - self.lows[0][0]
+        else:
+            up = down = 1
+        while self.highs and self.highs[-1][1] <= price:
+            self.highs.pop()
+        while self.lows and self.lows[-1][1] >= price:
+            self.lows.pop()
+        self.highs.append((position, price))
+        self.lows.append((position, price))
+        oldest = position + 2 - self.period
+        if self.highs[0][0] < oldest:
+            self.highs.popleft()
+        if self.lows[0][0] < oldest:
+            self.lows.popleft()
+        self.position += 1
+        return ((self.period - up) / self.period * 100.0,
+                (self.period - down) / self.period * 100.0)
+
+
+class Momentum(object):
+    """Resumable RSI, OBV and Aroon engine.
+
+    RSI uses Wilder smoothing with the same seeding as the original
+    three_graphs() implementation: the first bar counts its price as the
+    up move and both averages start from 1 - 1 / period.
+    """
+
+    def __init__(self, period=14, window=25):
+        self.alpha = 1.0 / period
+        self.last = None
+        self.smmau = self.smmad = 1.0
+        self.obv = 0.0
+        self.aroon = Aroon(window)
+
+    def extend(self, prices, volumes):
+        """Fold new bars and return their indicator columns."""
+        prices = np.asarray(prices, dtype=np.float64)
+        volumes = np.asarray(volumes, dtype=np.float64)
+        if not len(prices):
+            return {'rsi': prices.copy(), 'obv': prices.copy(),
+                    'aroonup': prices.copy(), 'aroondown': prices.copy()}
+        moves = np.diff(prices, prepend=0.0 if self.last is None
+                        else self.last)
+        updown = np.where(moves > 0, 1.0, -1.0)
+        if self.last is None:
+            updown[0] = 1.0
+        smmau = ema(np.maximum(moves, 0.0), self.alpha, self.smmau)
+        smmad = ema(np.maximum(-moves, 0.0), self.alpha, self.smmad)
+        obv = self.obv + np.cumsum(updown * volumes / prices)
+        aroons = np.array([self.aroon.update(p) for p in prices.tolist()])
+        self.last = prices[-1]
+        self.smmau, self.smmad, self.obv = smmau[-1], smmad[-1], obv[-1]
+        return {'rsi': rsi(smmau, smmad),
+                'obv': obv,
+                'aroonup': aroons[:, 0],
+                'aroondown': aroons[:, 1]}
+
+
+def rsi(smmau, smmad):
+    """Return RSI from smoothed up and down moves."""
+    total = np.asarray(smmau + smmad)
+    return np.divide(100.0 * smmau, total,
+                     out=np.full(total.shape, 50.0), where=total > 0)
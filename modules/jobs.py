@@ -0,0 +1,210 @@
+#!/usr/bin/python3
+"""Background datacenter report jobs backed by a process pool."""
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from threading import Event, Lock, Thread
+from time import time
+from uuid import uuid4
+
+from modules.archive import WRITERS
+from modules.cache import closed
+from modules.helpers import (coins_list, report_fields, report_path, scan,
+                             signals, summarize)
+
+# Spawned workers open their own MongoDB connections
+pool = None
+pool_lock = Lock()
+
+# Submitted jobs by id, newest last
+jobs = {}
+# Finished jobs kept for the datacenter page
+KEEP = 20
+
+
+def executor():
+    """Return the shared process pool, creating it on first use."""
+    global pool
+    with pool_lock:
+        if pool is None:
+            pool = ProcessPoolExecutor(
+                mp_context=multiprocessing.get_context('spawn'))
+        return pool
+
+
+class Job(object):
+    """A datacenter report computed coin by coin in the process pool."""
+
+    def __init__(self, coins, filepath, writer):
+        self.id = uuid4().hex[:8]
+        self.coins = coins
+        self.filepath = filepath
+        self.writer = writer
+        self.status = {c: 'pending' for c in coins}
+        self.errors = {}
+        self.futures = {}
+        self.started = time()
+        self.finished = None
+        self.failed = None
+        self.cancelled = Event()
+
+    @property
+    def target(self):
+        """Return the archive path of the finished file."""
+        return 'archive/{}.{}'.format(self.filepath, self.writer.extension)
+
+    @property
+    def done(self):
+        """Return the number of coins no longer pending."""
+        return sum(1 for s in self.status.values() if s != 'pending')
+
+    @property
+    def state(self):
+        """Return a one-word state of the whole job."""
+        if self.cancelled.is_set():
+            return 'cancelled'
+        if self.failed:
+            return 'failed'
+        return 'finished' if self.finished else 'running'
+
+    def eta(self):
+        """Return the estimated seconds left, or None before any coin."""
+        if not self.done or self.finished:
+            return None
+        elapsed = time() - self.started
+        return int(elapsed / self.done * (len(self.coins) - self.done))
+
+    def describe(self):
+        """Return the job as a dictionary for templates."""
+        return {'id': self.id,
+                'filename': os.path.basename(self.target),
+                'state': self.state,
+                'done': self.done,
+                'total': len(self.coins),
+                'percent': int(100 * self.done / len(self.coins)),
+                'eta': self.eta(),
+                'errors': self.errors}
+
+
+def write(job, output, coin, future):
+    """Write one coin's rows once its computation completes."""
+    try:
+        series = future.result()
+    except CancelledError:
+        job.status[coin] = 'cancelled'
+        return
+    except Exception as e:
+        logging.exception('Error summarizing [{}]!'.format(coin))
+        job.status[coin] = 'failed'
+        job.errors[coin] = str(e) or e.__class__.__name__
+        return
+    if series:
+        output.write(series)
+    job.status[coin] = 'done' if series else 'empty'
+
+
+def release(job, output, coin, future):
+    """Write a coin's rows and drop its future along with the result."""
+    write(job, output, coin, future)
+    job.futures.pop(coin, None)
+
+
+def prune():
+    """Forget the oldest finished jobs beyond KEEP."""
+    finished = [k for k, j in jobs.items() if j.finished]
+    for job_id in finished[:max(0, len(finished) - KEEP)]:
+        del jobs[job_id]
+
+
+def collect(job, futures, window):
+    """Write coins in order while at most `window` computations run.
+
+    Should the scan or the writer fail, the job is recorded as failed,
+    its remaining coins are cancelled and the partial file is removed.
+    """
+    target = job.target
+    pending = deque()
+    try:
+        output = job.writer(target + '.part', report_fields)
+        for coin, future in futures:
+            job.futures[coin] = future
+            pending.append((coin, future))
+            if len(pending) > window:
+                release(job, output, *pending.popleft())
+        while pending:
+            release(job, output, *pending.popleft())
+        output.close()
+        if job.cancelled.is_set():
+            os.remove(target + '.part')
+        else:
+            os.replace(target + '.part', target)
+    except Exception as e:
+        logging.exception('Error writing [{}]!'.format(job.filepath))
+        job.failed = job.errors['report'] = str(e) or e.__class__.__name__
+        for future in list(job.futures.values()):
+            future.cancel()
+        if os.path.exists(target + '.part'):
+            os.remove(target + '.part')
+    finally:
+        for coin, status in job.status.items():
+            if status == 'pending':
+                job.status[coin] = 'failed' if job.failed else \
+                    'cancelled' if job.cancelled.is_set() else 'empty'
+        job.finished = time()
+
+
+def partitions(job, interval, todate, fast, slow, signal, fromdate):
+    """Submit each pair of a single bar scan as it streams in."""
+    for coin, series in scan(interval, todate, fromdate, job.coins):
+        if job.cancelled.is_set():
+            break
+        yield coin, executor().submit(
+            signals, series, interval, coin, fast, slow, signal, fromdate)
+
+
+def submit(interval, todate, coin, fast, slow, signal, fromdate, fmt='csv'):
+    """Queue a datacenter report and return its job id at once.
+
+    A single coin is summarized directly; all coins share one scan of
+    the bars, partitioned by pair and computed in the process pool.
+    """
+    coins = [coin] if coin else list(coins_list)
+    job = Job(coins, report_path(interval, todate, coin, fast, slow, signal,
+                                 fromdate),
+              WRITERS[fmt])
+    prune()
+    jobs[job.id] = job
+    if closed(todate) and os.path.exists(job.target):
+        for c in coins:
+            job.status[c] = 'cached'
+        job.finished = time()
+        return job.id
+    if coin or not fromdate:
+        futures = [(c, executor().submit(
+            summarize, interval, todate, c, fast, slow, signal, fromdate))
+            for c in coins]
+        window = len(futures)
+    else:
+        futures = partitions(job, interval, todate, fast, slow, signal,
+                             fromdate)
+        window = 2 * (os.cpu_count() or 1)
+    Thread(target=collect, args=(job, futures, window), daemon=True).start()
+    return job.id
+
+
+def cancel(job_id):
+    """Cancel the pending coins of a job."""
+    job = jobs.get(job_id)
+    if not job or job.finished:
+        return False
+    job.cancelled.set()
+    for future in list(job.futures.values()):
+        future.cancel()
+    return True
+
+
+def overview():
+    """Return descriptions of all known jobs, newest first."""
+    return [j.describe() for j in reversed(list(jobs.values()))]
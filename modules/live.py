@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+"""Live indicator updates pushed to the graph pages."""
+import json
+import logging
+from collections import deque
+from threading import Condition, Lock, Thread
+from time import monotonic, sleep
+
+from pymongo.errors import PyMongoError
+
+from modules.helpers import (macd_columns, momentum_columns, points,
+                             summarize, utcdate)
+from modules.indicators import Macd, Momentum
+from modules.stats import pairs
+
+# Seconds between two reads of `pairs` without a change stream
+POLL = 5
+# Seconds a stream waits before sending a keep-alive comment
+KEEPALIVE = 25
+# Seconds a channel is kept once its last subscriber left
+IDLE = 120
+# Completed rows kept for subscribers catching up
+BACKLOG = 500
+
+# Request parameters of each graph page after interval and coin
+KINDS = {'graph': ('summarize', ['fast', 'slow', 'signal']),
+         'graphaddon': ('three_graphs', ['from'])}
+
+# One channel per watched graph, shared by all of its subscribers
+channels = {}
+lock = Lock()
+watcher = None
+
+
+class Channel(object):
+    """A shared indicator computation over the completed buckets of a pair."""
+
+    def __init__(self, kind, interval, coin, params):
+        self.kind = kind
+        self.interval = interval
+        self.coin = coin
+        self.params = params
+        self.engine = None
+        self.resume = None
+        self.rows = deque(maxlen=BACKLOG)
+        self.changed = Condition()
+        self.busy = Lock()
+        self.subscribers = 0
+        self.seen = monotonic()
+
+    @property
+    def pair(self):
+        """Return the market name of the channel."""
+        return 'BTC-' + self.coin
+
+    def start(self, todate):
+        """Compute the completed series so far and the engine after it."""
+        if KINDS[self.kind][0] == 'summarize':
+            series = summarize(self.interval, todate, self.coin,
+                               *self.params)
+            self.engine = Macd(*self.params)
+            self.build = macd_columns
+            if not series:
+                return series
+            series = series[:-1]
+            if series:
+                self.engine.ema_fast = series['ema_fast'][-1]
+                self.engine.ema_slow = series['ema_slow'][-1]
+                self.engine.signal_line = series['signal_line'][-1]
+            return series
+        self.engine = Momentum()
+        self.build = momentum_columns
+        return self.build(self.engine, points(
+            self.interval, todate, self.coin, *self.params)[:-1])
+
+    def refresh(self):
+        """Fold the buckets completed since the last refresh and publish."""
+        with self.busy:
+            todate = utcdate()
+            if self.resume is None:
+                series = self.start(todate)
+            else:
+                # Trades arrive in Id order: all buckets but the last are done
+                series = self.build(self.engine, points(
+                    self.interval, todate, self.coin, False,
+                    self.resume)[:-1])
+            if not series:
+                return
+            self.resume = (int(series['minute'][-1]),
+                           float(series['price'][-1]))
+            with self.changed:
+                self.rows.extend(series.rows())
+                self.changed.notify_all()
+
+    def newer(self, since=None, after=None):
+        """Return the kept rows from `since` on, or strictly after `after`."""
+        if after:
+            return [r for r in self.rows if r['datetime'] > after]
+        return [r for r in self.rows if not since or r['datetime'] >= since]
+
+    def wait(self, since=None, after=None, timeout=KEEPALIVE):
+        """Return newer rows, waiting up to `timeout` seconds for some."""
+        with self.changed:
+            self.changed.wait_for(lambda: self.newer(since, after), timeout)
+            return self.newer(since, after)
+
+
+def changes():
+    """Yield the pairs with new trades as they are stored."""
+    try:
+        with pairs.watch([{'$match': {'operationType':
+                                      {'$in': ['insert', 'update',
+                                               'replace']}}}],
+                         max_await_time_ms=POLL * 1000) as stream:
+            logging.info('Watching new trades through a change stream.')
+            while stream.alive:
+                change = stream.try_next()
+                if change:
+                    yield change['documentKey']['_id']
+    except PyMongoError as e:
+        logging.warning('No change stream ({}), polling every {} seconds.'
+                        .format(e, POLL))
+    markers = {}
+    while True:
+        for stat in pairs.find({}, {'last': 1}):
+            if markers.get(stat['_id'], stat['last']) != stat['last']:
+                yield stat['_id']
+            markers[stat['_id']] = stat['last']
+        sleep(POLL)
+
+
+def watch():
+    """Refresh the channels of every pair with new trades."""
+    global watcher
+    try:
+        for pair in changes():
+            with lock:
+                for name, each in list(channels.items()):
+                    if not each.subscribers and \
+                            monotonic() - each.seen > IDLE:
+                        del channels[name]
+                current = list(channels.values())
+            for each in [c for c in current if c.pair == pair]:
+                try:
+                    each.refresh()
+                except Exception:
+                    logging.exception('Unable to refresh [{}]!'.format(
+                        each.pair))
+    except Exception:
+        logging.exception('Live watcher stopped!')
+    finally:
+        # The next subscriber starts a new watcher
+        with lock:
+            watcher = None
+
+
+def channel(kind, interval, coin, params):
+    """Return the shared channel of a graph, starting it if needed."""
+    global watcher
+    name = (kind, interval, coin, tuple(params))
+    with lock:
+        if watcher is None:
+            watcher = Thread(target=watch, daemon=True)
+            watcher.start()
+        if name not in channels:
+            channels[name] = Channel(kind, interval, coin, params)
+        current = channels[name]
+    if current.resume is None:
+        current.refresh()
+    return current
+
+
+def events(current, since=None, after=None):
+    """Yield a channel's completed rows as server-sent events."""
+    with lock:
+        current.subscribers += 1
+    try:
+        while True:
+            rows = current.wait(since, after)
+            if not rows:
+                yield ': keep-alive\n\n'
+                continue
+            for row in rows:
+                yield 'id: {}\ndata: {}\n\n'.format(row['datetime'],
+                                                    json.dumps(row))
+            since, after = None, rows[-1]['datetime']
+    finally:
+        with lock:
+            current.subscribers -= 1
+            current.seen = monotonic()
@@ -0,0 +1,279 @@
+#!/usr/bin/python3
+"""Request, stage and MongoDB timings exposed in Prometheus text format."""
+import hmac
+import logging
+import os
+import random
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+from time import perf_counter
+
+from flask import (Response, abort, before_render_template, g, request,
+                   template_rendered)
+from pymongo import monitoring
+
+# Share of requests traced with their stages and MongoDB commands, and
+# seconds after which a request is logged
+SAMPLE = float(os.environ.get('METRICS_SAMPLE', 0.1))
+SLOW = os.environ.get('METRICS_SLOW') and float(os.environ['METRICS_SLOW'])
+
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+           2.5, 5.0, 10.0)
+
+# Bearer token scrapers send to read /metrics, which is off without one
+TOKEN = os.environ.get('METRICS_TOKEN')
+
+current = ContextVar('trace', default=None)
+
+
+class Metric(object):
+    """A named metric family keyed by label values."""
+
+    kind = 'untyped'
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        self.lock = Lock()
+
+
+class Histogram(Metric):
+    """Cumulative duration histogram per label values."""
+
+    kind = 'histogram'
+
+    def observe(self, seconds, *labels):
+        """Count one duration under the given label values."""
+        with self.lock:
+            counts = self.values.setdefault(labels,
+                                            [0] * (len(BUCKETS) + 2))
+            position = bisect_left(BUCKETS, seconds)
+            if position < len(BUCKETS):
+                counts[position] += 1
+            counts[-2] += seconds
+            counts[-1] += 1
+
+    def samples(self):
+        """Yield (suffix, labels, value) exposition samples."""
+        with self.lock:
+            values = {k: list(v) for k, v in self.values.items()}
+        for labels, counts in sorted(values.items()):
+            names = dict(zip(self.labels, labels))
+            total = 0
+            for bound, count in zip(BUCKETS, counts):
+                total += count
+                yield '_bucket', dict(names, le=str(bound)), total
+            yield '_bucket', dict(names, le='+Inf'), counts[-1]
+            yield '_sum', names, counts[-2]
+            yield '_count', names, counts[-1]
+
+
+class Counter(Metric):
+    """Monotonic total per label values."""
+
+    kind = 'counter'
+
+    def inc(self, amount, *labels):
+        """Add `amount` under the given label values."""
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        """Yield (suffix, labels, value) exposition samples."""
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield '', dict(zip(self.labels, labels)), value
+
+
+requests = Histogram('bitgeek_request_duration_seconds',
+                     'Request handling time until the response is returned.',
+                     ['route', 'method', 'status'])
+sampled = Counter('bitgeek_traced_requests_total',
+                  'Requests traced with stages and MongoDB commands.',
+                  ['route'])
+stages = Histogram('bitgeek_stage_duration_seconds',
+                   'Time of a computation stage in traced requests.',
+                   ['route', 'stage'])
+commands = Histogram('bitgeek_mongo_command_duration_seconds',
+                     'MongoDB command time in traced requests.',
+                     ['route', 'command'])
+returned = Counter('bitgeek_mongo_documents_returned_total',
+                   'Documents returned by MongoDB to traced requests.',
+                   ['route', 'command'])
+failures = Counter('bitgeek_mongo_command_failures_total',
+                   'Failed MongoDB commands in traced requests.',
+                   ['route', 'command'])
+REGISTRY = [requests, sampled, stages, commands, returned, failures]
+
+
+class Trace(object):
+    """Stage and MongoDB command times of one sampled request."""
+
+    def __init__(self, route):
+        self.route = route
+        self.stages = {}
+        self.commands = {}
+        self.rendering = None
+
+    def add(self, stage, seconds):
+        """Add time spent in a stage."""
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def command(self, name, seconds, documents=0, failed=False):
+        """Add a MongoDB command and the documents it returned."""
+        total = self.commands.setdefault(name, [0, 0.0, 0, 0])
+        total[0] += 1
+        total[1] += seconds
+        total[2] += documents
+        total[3] += failed
+
+    def record(self):
+        """Fold the trace into the registry."""
+        sampled.inc(1, self.route)
+        for stage, seconds in self.stages.items():
+            stages.observe(seconds, self.route, stage)
+        for name, (count, seconds, documents, failed) in \
+                self.commands.items():
+            commands.observe(seconds, self.route, name)
+            returned.inc(documents, self.route, name)
+            if failed:
+                failures.inc(failed, self.route, name)
+
+    def describe(self):
+        """Return the stage and command breakdown as one log line."""
+        parts = ['{} {:.1f}ms'.format(k, v * 1000)
+                 for k, v in sorted(self.stages.items())]
+        parts += ['mongo {} x{} {:.1f}ms {} docs'.format(
+            k, v[0], v[1] * 1000, v[2])
+            for k, v in sorted(self.commands.items())]
+        return ', '.join(parts) or 'no stages'
+
+
+@contextmanager
+def span(stage):
+    """Time a computation stage of the traced request, if any."""
+    trace = current.get()
+    if trace is None:
+        yield
+        return
+    started = perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, perf_counter() - started)
+
+
+class Commands(monitoring.CommandListener):
+    """Attribute MongoDB commands to the traced request issuing them."""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        trace = current.get()
+        if trace is None:
+            return
+        cursor = event.reply.get('cursor') or {}
+        batch = cursor.get('firstBatch', cursor.get('nextBatch', ()))
+        trace.command(event.command_name, event.duration_micros / 1e6,
+                      len(batch))
+
+    def failed(self, event):
+        trace = current.get()
+        if trace is not None:
+            trace.command(event.command_name, event.duration_micros / 1e6,
+                          failed=True)
+
+
+monitoring.register(Commands())
+
+
+def escape(value):
+    """Escape a label value for the text format."""
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace(
+        '\n', r'\n')
+
+
+def exposition():
+    """Return every metric in Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP {} {}'.format(metric.name, metric.help))
+        lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+        for suffix, labels, value in metric.samples():
+            lines.append('{}{}{{{}}} {}'.format(
+                metric.name, suffix, ','.join(
+                    '{}="{}"'.format(k, escape(v))
+                    for k, v in labels.items()), value))
+    return '\n'.join(lines) + '\n'
+
+
+def route():
+    """Return the rule matched by the current request as its label."""
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def instrument(app):
+    """Time every request of a Flask app and serve /metrics to scrapers."""
+
+    @app.before_request
+    def start():
+        g.started = perf_counter()
+        g.trace = Trace(route()) if random.random() < SAMPLE else None
+        g.token = current.set(g.trace)
+
+    @app.after_request
+    def finish(response):
+        started = g.pop('started', None)
+        if started is None:
+            return response
+        elapsed = perf_counter() - started
+        requests.observe(elapsed, route(), request.method,
+                         str(response.status_code))
+        trace = g.trace
+        if trace is not None:
+            trace.record()
+        if SLOW is not None and elapsed > SLOW:
+            logging.warning('Slow request {} {} ({}): {:.1f}ms{}'.format(
+                request.method, request.full_path.rstrip('?'), route(),
+                elapsed * 1000,
+                '; ' + trace.describe() if trace else ' (not traced)'))
+        return response
+
+    @app.teardown_request
+    def detach(error=None):
+        token = g.pop('token', None)
+        if token is not None:
+            current.reset(token)
+
+    def rendering(sender, template, context, **extra):
+        trace = current.get()
+        if trace is not None:
+            trace.rendering = perf_counter()
+
+    def rendered(sender, template, context, **extra):
+        trace = current.get()
+        if trace is not None and trace.rendering is not None:
+            trace.add('render', perf_counter() - trace.rendering)
+            trace.rendering = None
+
+    before_render_template.connect(rendering, app, weak=False)
+    template_rendered.connect(rendered, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        """Return the metrics to scrapers holding the token."""
+        if not TOKEN or not hmac.compare_digest(
+                request.headers.get('Authorization', '').encode(),
+                'Bearer {}'.format(TOKEN).encode()):
+            abort(403)
+        return Response(exposition(),
+                        mimetype='text/plain; version=0.0.4')
+
+    return app
@@ -0,0 +1,168 @@
+#!/usr/bin/python3
+"""Pre-aggregated OHLCV bars for Bittrex markets.
+
+Bars form a pyramid of resolutions: one document per pair per minute in
+`bars_1m`, each coarser level derived from the level right below it.
+The ingester refreshes the buckets it touches; run
+`python -m modules.rollups` to backfill bars for trades already stored,
+once `python -m modules.schema migrate` has typed their TimeStamps.
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from pymongo import ReplaceOne
+
+from modules.database import db
+from modules.storage import collection
+
+# Bar resolutions in minutes, finest first
+RESOLUTIONS = [(1, db.bars_1m),
+               (5, db.bars_5m),
+               (15, db.bars_15m),
+               (60, db.bars_1h),
+               (1440, db.bars_1d)]
+bars = RESOLUTIONS[0][1]
+
+EPOCH = datetime(1970, 1, 1)
+
+# Format of the bar minute labels
+LABEL = '%Y-%m-%dT%H:%M'
+
+
+def bucket(minute, size):
+    """Return the start of the `size`-minute bucket holding a minute."""
+    date = datetime.strptime(minute[:16], LABEL)
+    offset = (date - EPOCH) // timedelta(minutes=1) % size
+    return (date - timedelta(minutes=offset)).strftime(LABEL)
+
+
+def after(minute, size):
+    """Return the start of the bucket following the one at `minute`."""
+    return (datetime.strptime(minute, LABEL) +
+            timedelta(minutes=size)).strftime(LABEL)
+
+
+def resolution(interval):
+    """Return the coarsest (size, collection) level dividing an interval."""
+    return [r for r in RESOLUTIONS if not interval % r[0]][-1]
+
+
+def merge(minute, group):
+    """Combine consecutive chronological bars into a single bar."""
+    group = list(group)
+    data = {'Pair': group[0]['Pair'],
+            'minute': minute,
+            'open': group[0]['open'],
+            'high': max(b['high'] for b in group),
+            'low': min(b['low'] for b in group),
+            'close': group[-1]['close'],
+            'volume': sum(b['volume'] for b in group),
+            'total': sum(b['total'] for b in group),
+            'count': sum(b['count'] for b in group)}
+    data['vwap'] = data['total'] / data['volume'] if data['volume'] \
+        else data['close']
+    return data
+
+
+def pipeline(match):
+    """Return aggregation grouping matched trades into minute bars."""
+    return [{"$match": match},
+            {"$sort": {'TimeStamp': 1, 'Id': 1}},
+            {"$group":
+             {"_id":
+              {'Pair': '$Pair',
+               'minute': {"$dateToString": {'format': LABEL,
+                                            'date': '$TimeStamp'}}},
+              "open": {"$first": "$Price"},
+              "high": {"$max": "$Price"},
+              "low": {"$min": "$Price"},
+              "close": {"$last": "$Price"},
+              "volume": {"$sum": "$Quantity"},
+              "total": {"$sum": "$Total"},
+              "count": {"$sum": 1}}
+             }]
+
+
+def bar(group):
+    """Convert an aggregation group into a bar document."""
+    data = {k: v for k, v in group.items() if k != '_id'}
+    data.update(group['_id'])
+    data['vwap'] = data['total'] / data['volume'] if data['volume'] \
+        else data['close']
+    return data
+
+
+def store(target, documents, size=1000):
+    """Upsert bar documents in unordered batches and return the count."""
+    operations = []
+    count = 0
+    for data in documents:
+        operations.append(ReplaceOne(
+            {'Pair': data['Pair'], 'minute': data['minute']}, data,
+            upsert=True))
+        if len(operations) >= size:
+            target.bulk_write(operations, ordered=False)
+            count += len(operations)
+            operations = []
+    if operations:
+        target.bulk_write(operations, ordered=False)
+        count += len(operations)
+    return count
+
+
+def derive(pair, first=None, last=None):
+    """Rebuild coarser levels from finer ones between two minutes."""
+    for (fine, source), (size, target) in zip(RESOLUTIONS, RESOLUTIONS[1:]):
+        query = {'Pair': pair}
+        if first:
+            first, last = bucket(first, size), bucket(last, size)
+            query['minute'] = {'$gte': first, '$lt': after(last, size)}
+        cursor = source.find(query).sort([('minute', 1)])
+        store(target, (merge(minute, group) for minute, group in groupby(
+            cursor, key=lambda b: bucket(b['minute'], size))))
+
+
+def rollup(trades):
+    """Rebuild the bars touched by freshly ingested trades."""
+    spans = {}
+    for t in trades:
+        minute = t['TimeStamp'].replace(second=0, microsecond=0)
+        first, last = spans.get(t['Pair'], (minute, minute))
+        spans[t['Pair']] = (min(first, minute), max(last, minute))
+    count = 0
+    for pair, (first, last) in spans.items():
+        count += store(bars, (bar(g) for g in collection.aggregate(pipeline(
+            {'Pair': pair,
+             'TimeStamp': {'$gte': first,
+                           '$lt': last + timedelta(minutes=1)}}))))
+        derive(pair, first.strftime(LABEL), last.strftime(LABEL))
+    return count
+
+
+def backfill(pairs=None):
+    """Build bars for every stored trade, one pair at a time."""
+    pairs = pairs or collection.distinct('Pair')
+    legacy = [p for p in pairs if collection.find_one(
+        {'Pair': p, 'TimeStamp': {'$type': 'string'}}, {'_id': 1})]
+    if legacy:
+        logging.critical('String TimeStamps in {}, run `python -m '
+                         'modules.schema migrate` first!'.format(
+                             ', '.join(legacy)))
+        return False
+    for pair in pairs:
+        logging.info('Rolling up [{}]...'.format(pair))
+        count = store(bars, (bar(g) for g in collection.aggregate(
+            pipeline({'Pair': pair}), allowDiskUse=True)))
+        derive(pair)
+        logging.info('\t{} minute bars written.'.format(count))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s',
+                        level=logging.INFO, datefmt='%Y/%m/%dT%H:%M:%S')
+    parser = argparse.ArgumentParser(description='Backfill bar pyramid.')
+    parser.add_argument('pairs', nargs='*', help='pairs such as BTC-NEO')
+    if backfill(parser.parse_args().pairs) is False:
+        raise SystemExit(1)
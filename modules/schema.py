@@ -0,0 +1,221 @@
+#!/usr/bin/python3
+"""Index bootstrap and query-plan diagnostics for the Bittrex database.
+
+Run `python -m modules.schema bootstrap` to create the collections,
+indexes and validators, `python -m modules.schema migrate` to convert
+trades stored with string fields before backfilling their bars with
+`python -m modules.rollups`, `python -m modules.schema buckets` to
+copy them into time-series storage and `python -m modules.schema explain`
+to check every query shape of the app against the query planner.
+"""
+import argparse
+import logging
+from datetime import datetime
+
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from modules.bittrex import AMOUNTS, parse, typed
+from modules.database import db
+from modules.rollups import RESOLUTIONS
+from modules.stats import refresh
+from modules.storage import MODE, collection, create, write
+
+# Trade indexes of each storage mode as (keys, options); time-series
+# collections take no unique index and index their Pair and TimeStamp
+TRADE_INDEXES = {
+    'documents': [
+        ([('Pair', ASCENDING), ('Id', ASCENDING)], {'unique': True}),
+        ([('Pair', ASCENDING), ('TimeStamp', ASCENDING), ('Id', ASCENDING)],
+         {}),
+    ],
+    'timeseries': [
+        ([('Pair', ASCENDING), ('Id', ASCENDING)], {}),
+        ([('Pair', ASCENDING), ('TimeStamp', ASCENDING)], {}),
+    ],
+}
+
+# Compound indexes per collection as (keys, options)
+INDEXES = {
+    collection.name: TRADE_INDEXES[MODE],
+    'users': [
+        ([('username', ASCENDING)], {'unique': True}),
+    ],
+}
+for size, bars in RESOLUTIONS:
+    INDEXES[bars.name] = [
+        ([('Pair', ASCENDING), ('minute', ASCENDING)], {'unique': True})]
+
+# Document validators per collection; 'moderate' leaves legacy
+# documents writable until they are migrated
+VALIDATORS = {}
+if MODE == 'documents':
+    VALIDATORS['market'] = {'$jsonSchema': {
+        'bsonType': 'object',
+        'required': ['Id', 'Pair', 'TimeStamp'] + AMOUNTS,
+        'properties': dict({
+            'Id': {'bsonType': ['int', 'long']},
+            'Pair': {'bsonType': 'string'},
+            'TimeStamp': {'bsonType': 'date'},
+        }, **{f: {'bsonType': 'double'} for f in AMOUNTS}),
+    }}
+
+# Checkpoints of the data migrations in `migrations`
+MIGRATION = 'typed-market'
+BUCKETS = 'timeseries-market'
+
+
+def bootstrap():
+    """Create every collection, index and validator the app relies on."""
+    create()
+    for name, validator in VALIDATORS.items():
+        if name not in db.list_collection_names():
+            db.create_collection(name)
+        db.command('collMod', name, validator=validator,
+                   validationLevel='moderate')
+        logging.info('{}: validator set'.format(name))
+    for name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            created = db[name].create_index(keys, **options)
+            logging.info('{}: {}'.format(name, created))
+
+
+def batches(name, source, query, projection=None, batch=1000):
+    """Yield documents of `source` in `_id` order, one batch at a time.
+
+    The last `_id` of a batch is checkpointed in `migrations` once the
+    next one is asked for, so an interrupted migration resumes after the
+    last batch it finished, while the ingester keeps writing.
+    """
+    checkpoint = db.migrations.find_one({'_id': name}) or {}
+    while True:
+        if checkpoint.get('last'):
+            query = dict(query, _id={'$gt': checkpoint['last']})
+        documents = list(source.find(query, projection).sort(
+            [('_id', ASCENDING)]).limit(batch))
+        if not documents:
+            break
+        yield documents
+        checkpoint = {'last': documents[-1]['_id'],
+                      'count': checkpoint.get('count', 0) + len(documents)}
+        db.migrations.update_one({'_id': name}, {'$set': checkpoint},
+                                 upsert=True)
+        logging.info('{}: {} documents.'.format(name, checkpoint['count']))
+    db.migrations.update_one({'_id': name},
+                             {'$set': {'finished': datetime.utcnow()}},
+                             upsert=True)
+
+
+def migrate(batch=1000):
+    """Convert trades with string TimeStamps and amounts in place."""
+    for legacy in batches(MIGRATION, db.market,
+                          {'TimeStamp': {'$type': 'string'}},
+                          dict({f: 1 for f in AMOUNTS}, TimeStamp=1), batch):
+        db.market.bulk_write([UpdateOne(
+            {'_id': t['_id']},
+            {'$set': {k: v for k, v in typed(t).items() if k != '_id'}})
+            for t in legacy], ordered=False)
+    for mark in db.marks.find({'TimeStamp': {'$type': 'string'}},
+                              {'TimeStamp': 1}):
+        db.marks.update_one({'_id': mark['_id']},
+                            {'$set': {'TimeStamp': parse(
+                                mark['TimeStamp'])}})
+    refresh()
+
+
+def buckets(batch=1000):
+    """Copy the trades of `market` into the time-series `market_ts`.
+
+    Trades keep their `_id`, so the batch interrupted by a previous run
+    is only written once. Run it again after stopping the ingester to
+    copy the trades stored meanwhile, then set TRADE_STORAGE=timeseries.
+    """
+    target = create('timeseries')
+    resumed = db.migrations.find_one({'_id': BUCKETS}) is not None
+    for legacy in batches(BUCKETS, db.market, {}, None, batch):
+        trades = [typed(t) for t in legacy]
+        if resumed:
+            written = {t['_id'] for t in target.find(
+                {'TimeStamp': {'$gte': min(t['TimeStamp'] for t in trades),
+                               '$lte': max(t['TimeStamp'] for t in trades)},
+                 '_id': {'$in': [t['_id'] for t in trades]}}, {'_id': 1})}
+            trades = [t for t in trades if t['_id'] not in written]
+            resumed = False
+        if trades:
+            write(target, trades, 'timeseries')
+
+
+def shapes():
+    """Return the app's query shapes as (name, cursor) pairs."""
+    pair = 'BTC-NEO'
+    since = {'$gte': '2018-01-01T00:00', '$lt': '2018-01-02T00:00'}
+    moments = {'$gte': datetime(2018, 1, 1), '$lt': datetime(2018, 1, 2)}
+    market = collection
+    queries = [
+        ('fetch', market.find({'Pair': pair, 'TimeStamp': moments}).sort(
+            [('TimeStamp', DESCENDING)])),
+        ('ingest last Id', market.find({'Pair': pair}).sort(
+            [('Id', DESCENDING)]).limit(1)),
+        ('rollup trades', market.find({'Pair': pair, 'TimeStamp': moments})
+         .sort([('TimeStamp', ASCENDING), ('Id', ASCENDING)])),
+        ('stats bounds', market.find({'Pair': pair}).sort(
+            [('Pair', ASCENDING), ('TimeStamp', DESCENDING)]).limit(1)),
+        ('login', db.users.find({'username': 'admin'})),
+    ]
+    if MODE == 'documents':
+        queries.append(('ingest upsert', market.find({'Id': 1, 'Pair': pair})))
+    for size, bars in RESOLUTIONS:
+        queries.append(('points {}'.format(bars.name), bars.find(
+            {'Pair': pair, 'minute': since}).sort([('minute', ASCENDING)])))
+        queries.append(('points latest {}'.format(bars.name), bars.find(
+            {'Pair': pair, 'minute': {'$lt': since['$lt']}}).sort(
+                [('minute', DESCENDING)]).limit(67)))
+        queries.append(('scan {}'.format(bars.name), bars.find(
+            {'Pair': {'$in': [pair, 'BTC-ETH']}, 'minute': since}).sort(
+                [('Pair', ASCENDING), ('minute', ASCENDING)])))
+    return queries
+
+
+def stages(plan):
+    """Yield every stage name of a winning plan tree."""
+    yield plan['stage']
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            yield from stages(child)
+
+
+def explain():
+    """Log the plan of each query shape and flag unindexed ones."""
+    flagged = []
+    for name, cursor in shapes():
+        explained = cursor.explain()
+        # Time-series reads explain as a pipeline over their buckets
+        planner = explained.get('queryPlanner') or \
+            explained['stages'][0]['$cursor']['queryPlanner']
+        plan = planner['winningPlan']
+        plan = plan.get('queryPlan', plan)
+        names = list(stages(plan))
+        problems = [s for s in names if s in ('COLLSCAN', 'SORT')]
+        if problems:
+            flagged.append(name)
+            logging.warning('{}: {} (not index-backed)'.format(
+                name, ' <- '.join(names)))
+        else:
+            logging.info('{}: {}'.format(name, ' <- '.join(names)))
+    return flagged
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s',
+                        level=logging.INFO, datefmt='%Y/%m/%dT%H:%M:%S')
+    parser = argparse.ArgumentParser(description='Database schema tools.')
+    parser.add_argument('command', choices=['bootstrap', 'migrate',
+                                            'buckets', 'explain'])
+    command = parser.parse_args().command
+    if command == 'bootstrap':
+        bootstrap()
+    elif command == 'migrate':
+        migrate()
+    elif command == 'buckets':
+        buckets()
+    elif explain():
+        raise SystemExit(1)
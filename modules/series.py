@@ -0,0 +1,104 @@
+#!/usr/bin/python3
+"""Columnar bar series shared by the indicator stages.
+
+A BarSeries holds one int64 array of epoch minutes and one float64
+array per column. Slicing returns views, and adding indicator columns
+shares the arrays already there, so no stage copies the bars. Labels,
+dates and report rows are only formatted at the CSV, JSON and template
+edges.
+"""
+import numpy as np
+
+
+def minutes(labels):
+    """Convert 'YYYY-mm-ddTHH:MM' labels into epoch minutes."""
+    return np.array(labels, dtype='datetime64[m]').astype(np.int64)
+
+
+def labels(values):
+    """Convert epoch minutes into 'YYYY-mm-ddTHH:MM' labels."""
+    return np.asarray(values, dtype=np.int64).astype(
+        'datetime64[m]').astype(str).tolist()
+
+
+class BarSeries(object):
+    """Chronological buckets of a pair as columnar arrays."""
+
+    __slots__ = ('minute', 'columns', 'pair', 'interval')
+
+    def __init__(self, minute, columns, pair=None, interval=None):
+        self.minute = np.asarray(minute, dtype=np.int64)
+        self.columns = {k: np.asarray(v, dtype=np.float64)
+                        for k, v in columns.items()}
+        self.pair = pair
+        self.interval = interval
+
+    @classmethod
+    def empty(cls, pair=None, interval=None):
+        """Return a series without buckets."""
+        return cls([], {'price': [], 'volume': []}, pair, interval)
+
+    @classmethod
+    def concat(cls, parts):
+        """Join consecutive series of the same pair."""
+        first = parts[0]
+        return cls(np.concatenate([p.minute for p in parts]),
+                   {k: np.concatenate([p.columns[k] for p in parts])
+                    for k in first.columns},
+                   first.pair, first.interval)
+
+    def __len__(self):
+        return len(self.minute)
+
+    def __getitem__(self, key):
+        """Return a column by name, or a view of a slice of buckets."""
+        if isinstance(key, str):
+            return self.minute if key == 'minute' else self.columns[key]
+        return BarSeries(self.minute[key],
+                         {k: v[key] for k, v in self.columns.items()},
+                         self.pair, self.interval)
+
+    def extend(self, columns):
+        """Return the series with more columns, sharing the existing ones."""
+        merged = dict(self.columns)
+        merged.update(columns)
+        return BarSeries(self.minute, merged, self.pair, self.interval)
+
+    def labels(self):
+        """Return the bucket labels as 'YYYY-mm-ddTHH:MM' strings."""
+        return labels(self.minute)
+
+    def rows(self):
+        """Yield one report row per bucket, newest last."""
+        names = list(self.columns)
+        values = [self.columns[k].tolist() for k in names]
+        interval = '{}-Minute'.format(self.interval)
+        for label, *row in zip(self.labels(), *values):
+            data = dict(zip(names, row))
+            data['pair'] = self.pair
+            data['interval'] = interval
+            data['datetime'] = label
+            data['date'], data['time'] = label.split('T')
+            yield data
+
+
+def filled(minute, price, volume, interval, last=None, seed=None):
+    """Return bars with a zero-volume bucket for every missing one.
+
+    Bars are clock-aligned epoch minutes in chronological order. Missing
+    buckets carry the price of the bar before them; passing the `last`
+    bucket already seen and its `seed` price starts the fill right after
+    that bucket.
+    """
+    if not len(minute):
+        return minute, price, volume
+    start = minute[0] if last is None else last + interval
+    full = np.arange(start, minute[-1] + 1, interval, dtype=np.int64)
+    positions = (minute - start) // interval
+    previous = np.searchsorted(positions, np.arange(len(full)),
+                               side='right') - 1
+    prices = np.where(previous >= 0, price[np.maximum(previous, 0)],
+                      np.nan if seed is None else seed)
+    volumes = np.zeros(len(full))
+    volumes[positions] = volume
+    return full, prices, volumes
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+"""Dashboard statistics for the Bittrex database.
+
+Per-pair trade counts and first/last timestamps live in the `pairs`
+collection. The ingester keeps them up to date and
+`python -m modules.stats` rebuilds them from index-bounded lookups.
+Each pair also records when trades older than SETTLE were last stored,
+so cached indicator states built on those minutes can be dropped.
+Reports are served from an in-process TTL cache.
+"""
+import logging
+from datetime import datetime, timedelta
+from functools import wraps
+from threading import Lock
+from time import monotonic
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import PyMongoError
+
+from modules.database import db
+from modules.storage import collection
+pairs = db.pairs
+
+# Seconds after which a market without new trades is reported stale
+STALE = 3600
+
+# Trades may still arrive for minutes younger than this
+SETTLE = timedelta(minutes=10)
+
+
+def ttl_cache(seconds):
+    """Memoize a function's result per arguments for `seconds`."""
+    def decorator(f):
+        cache = {}
+        lock = Lock()
+
+        @wraps(f)
+        def decorated_function(*args):
+            now = monotonic()
+            with lock:
+                if args in cache and cache[args][0] > now:
+                    return cache[args][1]
+            value = f(*args)
+            with lock:
+                cache[args] = (now + seconds, value)
+            return value
+        decorated_function.cache = cache
+        return decorated_function
+    return decorator
+
+
+def track(trades):
+    """Fold freshly inserted trades into the per-pair statistics."""
+    spans = {}
+    for t in trades:
+        count, first, last = spans.get(
+            t['Pair'], (0, t['TimeStamp'], t['TimeStamp']))
+        spans[t['Pair']] = (count + 1, min(first, t['TimeStamp']),
+                            max(last, t['TimeStamp']))
+    now = datetime.utcnow()
+    for pair, (count, first, last) in spans.items():
+        latest = {'last': last}
+        if first < now - SETTLE:
+            latest['revised'] = now
+        pairs.update_one({'_id': pair},
+                         {'$inc': {'count': count},
+                          '$min': {'first': first},
+                          '$max': latest},
+                         upsert=True)
+
+
+def refresh():
+    """Rebuild the per-pair statistics from the stored trades."""
+    for pair in collection.distinct('Pair'):
+        bounds = [collection.find_one({'Pair': pair}, {'TimeStamp': 1},
+                                      sort=[('Pair', ASCENDING),
+                                            ('TimeStamp', order)])
+                  for order in (ASCENDING, DESCENDING)]
+        pairs.replace_one({'_id': pair},
+                          {'count': collection.count_documents(
+                              {'Pair': pair}),
+                           'first': bounds[0]['TimeStamp'],
+                           'last': bounds[1]['TimeStamp'],
+                           'revised': datetime.utcnow()},
+                          upsert=True)
+        logging.info('[{}] refreshed.'.format(pair))
+
+
+def moment(stamp):
+    """Return a stored TimeStamp as a datetime, legacy strings included."""
+    if isinstance(stamp, datetime):
+        return stamp
+    return datetime.strptime(stamp[:19], '%Y-%m-%dT%H:%M:%S')
+
+
+def freshness(stat, now):
+    """Return a per-pair report row with its age in minutes."""
+    first, last = moment(stat['first']), moment(stat['last'])
+    age = (now - last).total_seconds()
+    return {'pair': stat['_id'],
+            'count': stat['count'],
+            'first': first.strftime('%Y-%m-%dT%H:%M:%S'),
+            'last': last.strftime('%Y-%m-%dT%H:%M:%S'),
+            'age': int(age // 60),
+            'stale': age > STALE}
+
+
+@ttl_cache(60)
+def report():
+    """Return totals and per-pair freshness, stalest markets first."""
+    try:
+        stats = list(pairs.find())
+        if not stats:
+            return False
+        now = datetime.utcnow()
+        markets = sorted((freshness(s, now) for s in stats),
+                         key=lambda s: s['last'])
+        return {'count': sum(s['count'] for s in markets),
+                'from': min(s['first'] for s in markets),
+                'to': max(s['last'] for s in markets),
+                'pairs': markets}
+    except PyMongoError:
+        logging.exception('Unable to build the database report!')
+        return False
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s',
+                        level=logging.INFO, datefmt='%Y/%m/%dT%H:%M:%S')
+    refresh()
@@ -0,0 +1,40 @@
+#!/usr/bin/python3
+"""Storage modes of the raw trades."""
+import os
+
+from pymongo import UpdateOne
+
+from modules.database import db
+
+# Trades collection of each storage mode; run `python -m modules.schema
+# buckets` to copy existing trades into `market_ts` before switching
+NAMES = {'documents': 'market', 'timeseries': 'market_ts'}
+MODE = os.environ.get('TRADE_STORAGE', 'documents')
+
+# Time-series options of `market_ts`; pairs trade seconds to hours apart
+TIMESERIES = {'timeField': 'TimeStamp', 'metaField': 'Pair',
+              'granularity': 'minutes'}
+
+collection = db[NAMES[MODE]]
+
+
+def create(mode=MODE):
+    """Create the trades collection of a mode if it does not exist yet."""
+    name = NAMES[mode]
+    if mode == 'timeseries' and name not in db.list_collection_names():
+        db.create_collection(name, timeseries=TIMESERIES)
+    return db[name]
+
+
+def write(target, trades, mode=MODE):
+    """Store new trades and return (inserted trades, matched count)."""
+    # Time-series collections take neither upserts nor unique indexes;
+    # the ingester has already dropped the Ids seen for each pair
+    if mode == 'timeseries':
+        target.insert_many(trades, ordered=False)
+        return trades, 0
+    result = target.bulk_write([UpdateOne(
+        filter={'Id': t['Id'], 'Pair': t['Pair']},
+        update={'$set': t},
+        upsert=True) for t in trades], ordered=False)
+    return [trades[i] for i in result.upserted_ids], result.matched_count
@@ -1,22 +1,28 @@
 #!/usr/bin/python3
 """Simple Flask-based Bittrex API wrapper server."""
+import logging
 import os
 from functools import wraps
 
-from flask import (Flask, current_app, flash, redirect, render_template,
-                   request, send_from_directory, session, url_for)
-from flask_pymongo import PyMongo
-from modules.bittrex import fetch
+from flask import (Flask, Response, abort, current_app, flash, jsonify,
+                   redirect, render_template, request, send_from_directory,
+                   session, stream_with_context, url_for)
+from modules import api, cache, metrics
+from modules.archive import WRITERS
+from modules.bittrex import fetch, stream, timing
+from modules.cache import cached
+from modules.database import db
 from modules.forms import LoginForm
-from modules.helpers import (datacenter_report, get_report, summarize,
-                             tabulizer, three_graphs, utcdate)
+from modules.helpers import (get_report, summarize, tabulizer, three_graphs,
+                             utcdate)
+from modules.jobs import cancel, overview, submit
+from modules.live import KINDS, channel, events
 from werkzeug.security import check_password_hash
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['UPLOAD_FOLDER'] = 'archive'
-app.config['MONGO_DBNAME'] = 'bittrex'
-mongo = PyMongo(app)
+metrics.instrument(app)
 
 
 def login_required(f):
@@ -32,7 +38,7 @@ def login_required(f):
 
 def validate(form):
     """Check user data in MongoDB."""
-    user = mongo.db.users.find_one({'username': form.username.data})
+    user = db.users.find_one({'username': form.username.data})
     if user and check_password_hash(user['password'], form.password.data):
         return True
     else:
@@ -72,7 +78,7 @@ def logout():
 def download(filename):
     """Download a single file."""
     uploads = os.path.join(current_app.root_path, app.config['UPLOAD_FOLDER'])
-    return send_from_directory(directory=uploads, filename=filename)
+    return send_from_directory(uploads, filename)
 
 
 @app.route('/')
@@ -93,64 +99,54 @@ def report():
                        request.form['coin'])
         if result:
             flash('Found {} results!'.format(
-                len(result[1])), category='success')
+                result[1]), category='success')
             return render_template('report.html',
                                    name=session['username'],
                                    download=result[0],
-                                   data=result[1][:100])
+                                   data=result[2],
+                                   query=request.form)
         else:
             flash('No results found!', category='warning')
     return render_template('report.html', name=session['username'])
 
 
+@app.route('/export')
+@login_required
+def export():
+    """Stream a pair's trades as a CSV download."""
+    filename = '-'.join([timing(request.args['from']),
+                         timing(request.args['to']),
+                         request.args['coin']])
+    return Response(
+        stream_with_context(stream(request.args['from'],
+                                   request.args['to'],
+                                   request.args['coin'])),
+        mimetype='text/csv',
+        headers={'Content-Disposition':
+                 'attachment; filename={}.csv'.format(filename)})
+
+
 @app.route('/graphaddon', methods=['GET', 'POST'])
 @login_required
 def graphaddon():
     """Show the additional graphs page."""
     if request.method == 'POST':
-        result = three_graphs(int(request.form.get('interval')),
-                              request.form['to'],
-                              request.form['coin'],
-                              request.form['from'])
-        if result:
-            flash('Found {} results!'.format(
-                len(result)), category='success')
-            return render_template('graphaddon.html',
-                                   name=session['username'],
-                                   data=result,
-                                   tovalue=request.form['to'],
-                                   fromvalue=request.form['from'],
-                                   coinvalue=request.form['coin'],
-                                   minutes='*'.join([i['datetime']
-                                                     for i in result
-                                                     ]
-                                                    ),
-                                   rsi=[float(i['rsi'])
-                                           for i in
-                                           result
-                                        ],
-                                   overb=[float(70)
-                                          for i in
-                                          result
-                                          ],
-                                   overs=[float(30)
-                                          for i in
-                                          result
-                                          ],
-                                   obv=[float(i['obv'])
-                                        for i in
-                                        result
-                                        ],
-                                   aru=[float(i['aroonup'])
-                                        for i in
-                                        result
-                                        ],
-                                   ard=[float(i['aroondown'])
-                                        for i in
-                                        result
-                                        ])
-        else:
-            flash('No results found!', category='warning')
+        params = {'interval': request.form['interval'],
+                  'coin': request.form['coin'],
+                  'from': request.form['from']}
+        return render_template('graphaddon.html',
+                               name=session['username'],
+                               tovalue=request.form['to'],
+                               fromvalue=request.form['from'],
+                               coinvalue=request.form['coin'],
+                               pointsvalue=request.form.get('max_points'),
+                               series=url_for(
+                                   'api_series', kind='graphaddon',
+                                   to=request.form['to'],
+                                   max_points=request.form.get('max_points'),
+                                   **params),
+                               live=not request.form['to'] and url_for(
+                                   'live', kind='graphaddon', **params))
     return render_template('graphaddon.html', name=session['username'])
 
 
@@ -159,21 +155,58 @@ def graphaddon():
 def datacenter():
     """Show the datacenter page."""
     if request.method == 'POST':
-        datacenter_report(int(request.form.get('interval')),
-                          request.form['to'],
-                          request.form['coin'],
-                          request.form['fast'],
-                          request.form['slow'],
-                          request.form['signal'],
-                          request.form['from'])
-        flash('Started generation of a CSV file...', category='warning')
-        return render_template('datacenter.html',
-                               name=session['username'],
-                               filenames=[tabulizer(f) for f in
-                                          os.listdir('archive')])
+        job_id = submit(int(request.form.get('interval')),
+                        request.form['to'],
+                        request.form['coin'],
+                        request.form['fast'],
+                        request.form['slow'],
+                        request.form['signal'],
+                        request.form['from'],
+                        request.form.get('format', 'csv'))
+        flash('Started generation of a {} file (job {})...'.format(
+            request.form.get('format', 'csv').upper(), job_id),
+            category='warning')
+        return redirect(url_for('datacenter'))
     return render_template('datacenter.html', name=session['username'],
-                           filenames=[tabulizer(f) for f in
-                                      os.listdir('archive')])
+                           jobs=overview(), formats=sorted(WRITERS),
+                           filenames=[f for f in map(tabulizer,
+                                                     os.listdir('archive'))
+                                      if f])
+
+
+@app.route('/datacenter/cancel/<job_id>', methods=['POST'])
+@login_required
+def datacenter_cancel(job_id):
+    """Cancel a running datacenter job."""
+    if cancel(job_id):
+        flash('Cancelled job {}.'.format(job_id), category='warning')
+    else:
+        flash('Job {} is not running!'.format(job_id), category='danger')
+    return redirect(url_for('datacenter'))
+
+
+@app.route('/cache')
+@login_required
+def cache_stats():
+    """Show result cache counters."""
+    return jsonify(cache.stats())
+
+
+@app.route('/live/<kind>')
+@login_required
+def live(kind):
+    """Stream newly completed buckets of a graph as server-sent events."""
+    if kind not in KINDS:
+        abort(404)
+    feed = channel(kind, int(request.args['interval']),
+                   request.args['coin'],
+                   [request.args[p] for p in KINDS[kind][1]])
+    return Response(
+        stream_with_context(events(feed, request.args.get('since'),
+                                   request.headers.get('Last-Event-ID'))),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache',
+                 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/graph', methods=['GET', 'POST'])
@@ -181,55 +214,49 @@ def datacenter():
 def graph():
     """Show the graphs page."""
     if request.method == 'POST':
-        result = summarize(int(request.form.get('interval')),
-                           request.form['to'] or utcdate(),
-                           request.form['coin'],
-                           request.form['fast'],
-                           request.form['slow'],
-                           request.form['signal'])
-        if result:
-            flash('Found {} results!'.format(
-                len(result)), category='success')
-            return render_template('graph.html',
-                                   name=session['username'],
-                                   data=result,
-                                   tovalue=request.form['to'],
-                                   coinvalue=request.form['coin'],
-                                   prices=[float(i['price'])
-                                           for i in
-                                           result
-                                           ][::-1
-                                             ],
-                                   fastes=[float(i['ema_fast'])
-                                           for i in result
-                                           ][::-1
-                                             ],
-                                   slowes=[float(i['ema_slow'])
-                                           for i in result
-                                           ][::-1
-                                             ],
-                                   minutes='*'.join([i['datetime']
-                                                     for i in result
-                                                     ][::-1
-                                                       ]
-                                                    ),
-                                   macds=[float(i['macd'])
-                                           for i in result
-                                          ][::-1
-                                            ],
-                                   macd_hists=[float(i['macd_hist'])
-                                               for i in result
-                                               ][::-1
-                                                 ],
-                                   signallines=[float(i['signal_line'])
-                                                for i in result
-                                                ][::-1
-                                                  ],
-                                   bearbull=float(result[0]['macd_hist']))
-        else:
-            flash('No results found!', category='warning')
+        params = {'interval': request.form['interval'],
+                  'coin': request.form['coin'],
+                  'fast': request.form['fast'],
+                  'slow': request.form['slow'],
+                  'signal': request.form['signal']}
+        return render_template('graph.html',
+                               name=session['username'],
+                               tovalue=request.form['to'],
+                               coinvalue=request.form['coin'],
+                               pointsvalue=request.form.get('max_points'),
+                               series=url_for(
+                                   'api_series', kind='graph',
+                                   to=request.form['to'],
+                                   max_points=request.form.get('max_points'),
+                                   **params),
+                               live=not request.form['to'] and url_for(
+                                   'live', kind='graph', **params))
     return render_template('graph.html', name=session['username'])
 
 
+@app.route('/api/series/<kind>')
+@login_required
+def api_series(kind):
+    """Return the chart series of a graph page as columnar JSON."""
+    interval = int(request.args['interval'])
+    todate = request.args.get('to') or utcdate()
+    if kind == 'graph':
+        series = cached(summarize, interval, todate, request.args['coin'],
+                        request.args['fast'], request.args['slow'],
+                        request.args['signal'])
+    elif kind == 'graphaddon':
+        series = cached(three_graphs, interval, todate,
+                        request.args['coin'], request.args['from'])
+    else:
+        abort(404)
+    with metrics.span('columnar'):
+        data = api.downsample(api.columnar(kind, series),
+                              request.args.get('max_points', type=int))
+    with metrics.span('serialize'):
+        return api.respond(request, data)
+
+
 if __name__ == '__main__':
+    logging.basicConfig(format='[%(asctime)s] %(levelname)s: %(message)s',
+                        level=logging.INFO, datefmt='%Y/%m/%dT%H:%M:%S')
     app.run(debug=False)
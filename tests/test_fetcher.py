@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+"""Fetcher tests against a local stub of the Bittrex API."""
+import json
+import sys
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os.path import abspath, dirname
+from threading import Thread
+from time import monotonic
+from urllib.parse import parse_qs, urlparse
+
+import mongomock
+import pytest
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+from modules import bittrex, daemon, database  # noqa: E402
+from modules.fetcher import Fetcher  # noqa: E402
+
+START = datetime(2018, 1, 1)
+
+
+def page(first, last, status=200):
+    """Return a canned market history of Ids first..last, newest first."""
+    return status, [{'Id': i,
+                     'TimeStamp': (START + timedelta(seconds=i)).isoformat(),
+                     'Quantity': 1.0, 'Price': 0.001, 'Total': 0.001,
+                     'FillType': 'FILL', 'OrderType': 'BUY'}
+                    for i in range(last, first - 1, -1)]
+
+
+class Stub(BaseHTTPRequestHandler):
+    """Serve the queued pages of each market, repeating the last one."""
+
+    pages = {}
+    requests = []
+
+    def do_GET(self):
+        pair = parse_qs(urlparse(self.path).query)['market'][0]
+        self.requests.append((pair, monotonic()))
+        queue = self.pages[pair]
+        status, result = queue.pop(0) if len(queue) > 1 else queue[0]
+        body = json.dumps({'success': status == 200,
+                           'result': result}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    """Run the stub API and return its base URL."""
+    Stub.pages, Stub.requests = {}, []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Stub)
+    Thread(target=server.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}/'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def mongo():
+    """Point the shared client at an in-memory database."""
+    database.shared = mongomock.MongoClient()
+    bittrex.last_ids.clear()
+    yield database.db
+    database.shared = None
+    bittrex.last_ids.clear()
+
+
+def fetcher(url, pairs, ingest, **options):
+    """Return a fetcher of the stub without retry backoff."""
+    options = dict({'rate': 100.0, 'backoff': 0}, **options)
+    return Fetcher(pairs, ingest, base_url=url, **options)
+
+
+def test_overlapping_pages_are_stored_once(stub, mongo):
+    Stub.pages['BTC-NEO'] = [page(6, 10), page(8, 12)]
+    markets = fetcher(stub, ['BTC-NEO'], bittrex.ingest)
+    assert markets.sweep() == {'BTC-NEO': {'inserted': 5, 'seen': 0}}
+    assert markets.sweep() == {'BTC-NEO': {'inserted': 2, 'seen': 3}}
+    stored = sorted(t['Id'] for t in mongo.market.find({'Pair': 'BTC-NEO'}))
+    assert stored == list(range(6, 13))
+
+
+def test_gap_is_detected_by_id(stub, mongo):
+    Stub.pages['BTC-NEO'] = [page(1, 5), page(4, 8), page(16, 20)]
+    markets = fetcher(stub, ['BTC-NEO'], daemon.record)
+    assert not markets.sweep()['BTC-NEO']['gap']
+    assert not markets.sweep()['BTC-NEO']['gap']
+    assert markets.sweep()['BTC-NEO']['gap']
+    mark = mongo.marks.find_one({'_id': 'BTC-NEO'})
+    assert (mark['Id'], mark['gaps'], mark['polls']) == (20, 1, 3)
+
+
+def test_requests_stay_within_rate_budget(stub):
+    pairs = ['BTC-M{}'.format(m) for m in range(6)]
+    for pair in pairs:
+        Stub.pages[pair] = [page(1, 3)]
+    markets = fetcher(stub, pairs, None, rate=20.0, workers=6)
+    assert all(markets.sweep().values())
+    times = sorted(t for pair, t in Stub.requests)
+    assert times[-1] - times[0] >= (len(pairs) - 1) / 20.0 * 0.9
+
+
+def test_server_errors_are_retried(stub):
+    Stub.pages['BTC-NEO'] = [page(1, 0, 503), page(1, 5)]
+    markets = fetcher(stub, ['BTC-NEO'], None)
+    assert markets.sweep() == {'BTC-NEO': {'inserted': 5, 'seen': 0}}
+    assert len(Stub.requests) == 2
+
+
+def test_failing_market_does_not_stop_sweep(stub):
+    Stub.pages['BTC-NEO'] = [page(1, 0, 500)]
+    Stub.pages['BTC-ETH'] = [page(1, 5)]
+    markets = fetcher(stub, ['BTC-NEO', 'BTC-ETH'], None, retries=1)
+    counts = markets.sweep()
+    assert counts['BTC-NEO'] is None
+    assert counts['BTC-ETH'] == {'inserted': 5, 'seen': 0}
+    assert [p for p, t in Stub.requests].count('BTC-NEO') == 2